@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import shutil
+
+from ultralytics import YOLO
+
+from evaluation import evaluate, list_images, split_dir
+
+DATA_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml")
+
+# Backend name -> ultralytics export arguments; "pytorch" uses the weights as is.
+# Every export takes dynamic batches: the gate, the Streamlit server, video
+# jobs, multi-camera batching and batch-detect all predict several images at
+# once. batch is the INT8 calibration batch.
+EXPORTS = {
+    "onnx": {"format": "onnx", "dynamic": True},
+    "openvino": {"format": "openvino", "dynamic": True},
+    "openvino-int8": {"format": "openvino", "dynamic": True, "int8": True, "batch": 8},
+}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def cache_entry(weights, backend, imgsz, cache_dir):
+    # One directory per weights content, backend, export arguments and input size
+    options = hashlib.sha256(json.dumps(EXPORTS.get(backend, {}), sort_keys=True).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{file_hash(weights)}-{backend}-{options}-{imgsz}")
+
+
+def load_model(path):
+    return YOLO(path, task="detect")
+
+
+def accuracy(entry, path, data, imgsz):
+    # mAP on the test split, computed once per cache entry
+    result_path = os.path.join(entry, "accuracy.json")
+    if os.path.exists(result_path):
+        with open(result_path) as f:
+            return json.load(f)
+    os.makedirs(entry, exist_ok=True)
+    result = evaluate(load_model(path), list_images(split_dir(data, "test")), imgsz=imgsz)
+    result = {"map50": result["map50"], "map50_95": result["map50_95"]}
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+    return result
+
+
+def export(weights, backend, entry, data, imgsz):
+    # Export next to the weights (ultralytics' choice) and move into the cache
+    options = dict(EXPORTS[backend])
+    if options.get("int8"):
+        options["data"] = data  # Calibration images for quantization
+    exported = YOLO(weights).export(imgsz=imgsz, **options)
+    os.makedirs(entry, exist_ok=True)
+    target = os.path.join(entry, os.path.basename(os.path.normpath(exported)))
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    shutil.move(exported, target)
+    return target
+
+
+def model_path(weights, backend="pytorch", data=DATA_YAML, imgsz=640, max_drop=0.01, cache_dir=None):
+    # Path to load for the requested backend. Exports are cached; an export
+    # whose test mAP50-95 is more than max_drop below the PyTorch weights is
+    # refused and the PyTorch weights are returned instead.
+    if backend == "pytorch":
+        return weights
+    if backend not in EXPORTS:
+        raise ValueError(f"unknown backend {backend!r}, expected pytorch or one of {', '.join(EXPORTS)}")
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(weights)), ".model-cache")
+
+    entry = cache_entry(weights, backend, imgsz, cache_dir)
+    artefacts = [name for name in os.listdir(entry) if name != "accuracy.json"] if os.path.isdir(entry) else []
+    if artefacts:
+        path = os.path.join(entry, artefacts[0])
+    else:
+        print(f"Exporting {weights} for {backend}...")
+        path = export(weights, backend, entry, data, imgsz)
+
+    baseline = accuracy(cache_entry(weights, "pytorch", imgsz, cache_dir), weights, data, imgsz)
+    candidate = accuracy(entry, path, data, imgsz)
+    drop = baseline["map50_95"] - candidate["map50_95"]
+    if drop > max_drop:
+        print(f"Refusing {backend} model: mAP50-95 {candidate['map50_95']:.4f} vs "
+              f"{baseline['map50_95']:.4f} for PyTorch (drop {drop:.4f} > {max_drop}), using PyTorch")
+        return weights
+    print(f"Using {backend} model {path} (mAP50-95 {candidate['map50_95']:.4f}, PyTorch {baseline['map50_95']:.4f})")
+    return path
+
+
+def model_path_from_env(weights, env, imgsz=640):
+    # MODEL_BACKEND and BACKEND_MAX_MAP_DROP, shared by every entry point
+    return model_path(
+        weights,
+        env.get("MODEL_BACKEND", "pytorch"),
+        imgsz=imgsz,
+        max_drop=float(env.get("BACKEND_MAX_MAP_DROP", 0.01)),
+        cache_dir=env.get("MODEL_CACHE_DIR") or None,
+    )
@@ -0,0 +1,147 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from backends import load_model, model_path
+from evaluation import IMAGE_EXTENSIONS, result_arrays
+
+# Set per worker process by init_worker
+model = None
+
+
+def find_images(root):
+    # Every image below root, as sorted paths relative to it
+    paths = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, name), root))
+    return sorted(paths)
+
+
+def load_done(output):
+    # Files already in the results file; makes sure appends start on a new line
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                pass  # Partial line from an interrupted run
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    return done
+
+
+def init_worker(weights, threads):
+    # One model per process; torch threads are split between the workers so
+    # they don't oversubscribe the cores
+    global model
+    import torch
+
+    torch.set_num_threads(threads)
+    model = load_model(weights)
+
+
+def detect(root, files, conf, imgsz):
+    start = time.perf_counter()
+    results = model.predict([os.path.join(root, name) for name in files], conf=conf, imgsz=imgsz, verbose=False)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    records = []
+    for name, result in zip(files, results):
+        boxes, confidences, classes = result_arrays(result)
+        labels = [model.names[int(c)] for c in classes]
+        height, width = result.orig_shape
+        records.append({
+            "file": name,
+            "width": width,
+            "height": height,
+            "classes": sorted(set(labels)),
+            "boxes": [[round(float(v), 1) for v in box] for box in boxes],
+            "labels": labels,
+            "conf": [round(float(c), 4) for c in confidences],
+            "ms": {stage: round(ms, 2) for stage, ms in result.speed.items()},
+            "batch_ms": round(batch_ms, 2),
+            "worker": os.getpid(),
+        })
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the detector over a folder of images in parallel")
+    parser.add_argument("source", nargs="?",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "images"),
+                        help="directory searched recursively for images")
+    parser.add_argument("--weights", default="tap-n-go-detection.pt")
+    parser.add_argument("--backend", default="pytorch", help="pytorch, onnx, openvino or openvino-int8")
+    parser.add_argument("--output", default="detections.jsonl", help="JSON-lines results, appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--batch", type=int, default=8, help="images per predict call")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--restart", action="store_true", help="ignore earlier results instead of resuming")
+    args = parser.parse_args()
+
+    files = find_images(args.source)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_done(args.output)
+    todo = [name for name in files if name not in done]
+    print(f"{len(files)} images, {len(done)} already done, {len(todo)} to process")
+    if not todo:
+        return
+
+    # Export (and accuracy-check) once here rather than in every worker
+    weights = model_path(args.weights, args.backend, imgsz=args.imgsz)
+
+    workers = max(1, min(args.workers, -(-len(todo) // args.batch)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    batches = [todo[i:i + args.batch] for i in range(0, len(todo), args.batch)]
+
+    processed = 0
+    start = time.perf_counter()
+    # spawn: model_path() may have loaded torch (export, mAP gate) here, and
+    # forking a process that holds torch/OpenMP threads can deadlock
+    with open(args.output, "a") as out, ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(weights, threads)
+    ) as pool:
+        # Keep a couple of batches queued per worker rather than all of them,
+        # so an interrupted run leaves little work in flight
+        pending = set()
+        next_batch = 0
+        try:
+            while pending or next_batch < len(batches):
+                while next_batch < len(batches) and len(pending) < workers * 2:
+                    pending.add(pool.submit(detect, args.source, batches[next_batch], args.conf, args.imgsz))
+                    next_batch += 1
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    records = future.result()
+                    for record in records:
+                        out.write(json.dumps(record) + "\n")
+                    processed += len(records)
+                out.flush()
+
+                elapsed = time.perf_counter() - start
+                print(f"\r{processed}/{len(todo)} images, {processed / elapsed:.1f} images/s", end="", flush=True)
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            print("\nInterrupted, rerun the same command to resume")
+            return
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+from backends import EXPORTS, load_model, model_path
+from capture import FrameGrabber
+from evaluation import evaluate, list_images, split_dir
+from mjpeg import MJPEGServer
+from publisher import DetectionPublisher
+
+STAGES = ("capture", "preprocess", "inference", "postprocess", "classes", "publish", "total")
+
+
+class NullClient:
+    # Stands in for the paho client so the publish path runs without a broker
+    def __init__(self):
+        self.messages = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages += 1
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+
+def image_frames(paths, repeat):
+    # (capture ms, frame) from the dataset files
+    for _ in range(repeat):
+        for path in paths:
+            start = time.perf_counter()
+            frame = cv2.imread(path)
+            yield (time.perf_counter() - start) * 1000, frame
+
+
+def mjpeg_frames(paths, count, fps, decode_size=None):
+    # (capture ms, frame) from a local ESP32-CAM style stream of the dataset
+    jpegs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            jpegs.append(f.read())
+    server = MJPEGServer(jpegs, port=0, fps=fps, host="127.0.0.1").start()
+    cam = FrameGrabber(server.url, decode_size=decode_size).start()
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            ret, frame = cam.read(timeout=10)
+            if not ret:
+                print("MJPEG stream stalled")
+                break
+            yield (time.perf_counter() - start) * 1000, frame
+    finally:
+        cam.release()
+        server.close()
+        print("Capture stats:", cam.stats())
+
+
+def run_pipeline(model, frames, publisher, conf):
+    # Same steps as the object-detection.py loop, timed per stage (ms)
+    timings = {stage: [] for stage in STAGES}
+    for capture_ms, frame in frames:
+        start = time.perf_counter()
+        results = model.predict(frame, conf=conf, verbose=False)
+        speed = results[0].speed
+
+        classes_start = time.perf_counter()
+        detected_classes = set()
+        for result in results:
+            for box in result.boxes:
+                cls_id = int(box.cls.item())
+                detected_classes.add(model.names[cls_id])
+
+        publish_start = time.perf_counter()
+        publisher.update(detected_classes)
+        end = time.perf_counter()
+
+        timings["capture"].append(capture_ms)
+        timings["preprocess"].append(speed["preprocess"])
+        timings["inference"].append(speed["inference"])
+        timings["postprocess"].append(speed["postprocess"])
+        timings["classes"].append((publish_start - classes_start) * 1000)
+        timings["publish"].append((end - publish_start) * 1000)
+        timings["total"].append(capture_ms + (end - start) * 1000)
+    return timings
+
+
+def compare(current, baseline_path, tolerance):
+    # Print changes against an earlier run; True if anything regressed
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressed = False
+    for stage, stats in current["stages"].items():
+        old = baseline.get("stages", {}).get(stage, {}).get("p95")
+        # Stages without samples (e.g. "plot" when headless) have no percentiles
+        if old and "p95" in stats:
+            change = (stats["p95"] - old) / old * 100
+            flag = " REGRESSION" if change > tolerance else ""
+            regressed |= bool(flag)
+            print(f"{stage:12s} p95 {old:8.2f} -> {stats['p95']:8.2f} ms ({change:+.1f}%){flag}")
+
+    old_fps = baseline.get("throughput_fps")
+    if old_fps:
+        change = (current["throughput_fps"] - old_fps) / old_fps * 100
+        flag = " REGRESSION" if change < -tolerance else ""
+        regressed |= bool(flag)
+        print(f"{'throughput':12s} {old_fps:8.2f} -> {current['throughput_fps']:8.2f} FPS ({change:+.1f}%){flag}")
+
+    for key in ("map50", "map50_95"):
+        old = baseline.get("accuracy", {}).get(key)
+        new = current.get("accuracy", {}).get(key)
+        if old is not None and new is not None:
+            # Accuracy is compared in absolute mAP points
+            flag = " REGRESSION" if old - new > tolerance / 100 else ""
+            regressed |= bool(flag)
+            print(f"{key:12s} {old:8.4f} -> {new:8.4f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the bundled dataset through the detection pipeline")
+    parser.add_argument("--weights", default="tap-n-go-detection.pt")
+    parser.add_argument("--backend", default="pytorch", choices=("pytorch",) + tuple(EXPORTS))
+    parser.add_argument("--max-drop", type=float, default=0.01,
+                        help="largest mAP50-95 drop accepted for an exported backend")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml"))
+    parser.add_argument("--split", default="test", choices=("train", "valid", "test"))
+    parser.add_argument("--source", default="images", choices=("images", "mjpeg"),
+                        help="read files directly or through a local MJPEG stream")
+    parser.add_argument("--fps", type=float, default=30, help="MJPEG stream rate")
+    parser.add_argument("--decode-size", type=int,
+                        help="read the MJPEG stream with MJPEGClient, decoding down to this size (default: OpenCV)")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the split")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed frames before measuring")
+    parser.add_argument("--conf", type=float, default=0.6, help="confidence used by the pipeline")
+    parser.add_argument("--no-accuracy", action="store_true", help="skip the mAP pass")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=10, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    model = load_model(model_path(args.weights, args.backend, data=args.data, max_drop=args.max_drop))
+    paths = list_images(split_dir(args.data, args.split))
+    if not paths:
+        parser.error(f"no images found for split {args.split}")
+
+    # Warm-up so lazy initialisation doesn't land in the percentiles
+    for path in paths[:args.warmup]:
+        model.predict(path, conf=args.conf, verbose=False)
+
+    client = NullClient()
+    publisher = DetectionPublisher(client, "/benchmark")
+    if args.source == "images":
+        frames = image_frames(paths, args.repeat)
+    else:
+        frames = mjpeg_frames(paths, len(paths) * args.repeat, args.fps, args.decode_size)
+
+    start = time.perf_counter()
+    timings = run_pipeline(model, frames, publisher, args.conf)
+    elapsed = time.perf_counter() - start
+    count = len(timings["total"])
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count()},
+        "frames": count,
+        "throughput_fps": count / elapsed if elapsed else 0.0,
+        "messages_published": client.messages,
+        "stages": {stage: percentiles(values) for stage, values in timings.items()},
+    }
+    if not args.no_accuracy:
+        results["accuracy"] = evaluate(model, paths)
+
+    for stage, stats in results["stages"].items():
+        if stats:
+            print(f"{stage:12s} p50 {stats['p50']:8.2f}  p95 {stats['p95']:8.2f}  p99 {stats['p99']:8.2f} ms")
+    print(f"{'throughput':12s} {results['throughput_fps']:.2f} FPS over {count} frames")
+    if "accuracy" in results:
+        print(f"{'mAP50':12s} {results['accuracy']['map50']:.4f}  mAP50-95 {results['accuracy']['map50_95']:.4f}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", args.output)
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
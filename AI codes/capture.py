@@ -0,0 +1,204 @@
+import threading
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+import cv2
+
+from mjpeg import MJPEGClient, decode_jpeg
+
+
+class SnapshotCapture:
+    # cv2.VideoCapture look-alike for the ESP32-CAM /capture endpoint: every
+    # read() fetches and decodes one JPEG, e.g. http://cam/capture?framesize=VGA
+
+    def __init__(self, url, timeout=5, min_size=0):
+        self.url = url
+        self.timeout = timeout
+        self.min_size = min_size  # See mjpeg.decode_jpeg
+        self.opened = self.read()[0]
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                data = response.read()
+        except OSError:
+            return False, None
+        frame = decode_jpeg(data, self.min_size)
+        return frame is not None, frame
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+
+class FrameGrabber:
+    # Drains a camera stream on a background thread and keeps only the newest
+    # frame, so inference never works on frames buffered while it was busy.
+    # With decode_size set, HTTP streams are read with MJPEGClient and JPEGs
+    # are decoded at reduced scale down to that long side (0 = full size);
+    # otherwise OpenCV's VideoCapture is used.
+
+    def __init__(self, url, reconnect_delay=2, on_frame=None, metrics=None, decode_size=None):
+        self.url = url
+        self.decode_size = decode_size
+        self.reconnect_delay = reconnect_delay
+        self.on_frame = on_frame  # Called from the grabber thread after each new frame
+        self.metrics = metrics  # Optional Metrics, receives the "decode" stage
+        self.cam = self._open()
+
+        # Single-slot latest-frame buffer
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._timestamp = 0.0
+        self._consumed_seq = 0
+        self.read_timestamp = 0.0  # Capture time of the frame last returned by read()
+        self.read_seq = 0  # Its sequence number
+        self._paused = False
+
+        # Counters
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+
+        self._running = False
+        self._thread = None
+
+    def _open(self):
+        if urlparse(self.url).path.endswith("/capture"):
+            return SnapshotCapture(self.url, min_size=self.decode_size or 0)
+        if self.decode_size is not None and self.url.startswith(("http://", "https://")):
+            return MJPEGClient(self.url, min_size=self.decode_size)
+        cam = cv2.VideoCapture(self.url)
+        # Keep OpenCV's own buffer as small as the backend allows
+        cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cam
+
+    def isOpened(self):
+        return self.cam.isOpened()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def _wait_consumed(self):
+        # Snapshot cameras are polled on demand: fetch the next frame only
+        # once the consumer has taken the previous one
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq == self._consumed_seq or not self._running)
+
+    def pause(self):
+        # Close the stream until resume(); frames from before the pause are never returned
+        with self._cond:
+            self._paused = True
+            self._consumed_seq = self._seq
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def _run(self):
+        # The capture is released here, once no read() can be in progress
+        try:
+            while self._running:
+                if self._paused:
+                    self.cam.release()
+                    with self._cond:
+                        self._cond.wait_for(lambda: not self._paused or not self._running)
+                    if not self._running:
+                        break
+                    self.cam = self._open()
+                    continue
+                if isinstance(self.cam, SnapshotCapture):
+                    self._wait_consumed()
+                    if not self._running:
+                        break
+                start = time.perf_counter()
+                ret, frame = self._read()
+                decode = time.perf_counter() - start
+                if ret and self.metrics is not None:
+                    # Network wait plus JPEG decode, as seen by the grabber thread
+                    self.metrics.observe("decode", decode)
+                if not ret:
+                    print("Frame retrieval error, trying to reconnect...")
+                    self.cam.release()
+                    time.sleep(self.reconnect_delay)
+                    if self._running:
+                        self.cam = self._open()
+                        self.reconnects += 1
+                    continue
+
+                if self._store(frame, decode) and self.on_frame is not None:
+                    self.on_frame()
+        finally:
+            self.cam.release()
+
+    def _read(self):
+        return self.cam.read()
+
+    def _store(self, frame, decode):
+        # Publish a new frame to the consumer; False if it was discarded
+        with self._cond:
+            if self._paused:
+                # Read finished after pause(), the frame is already stale
+                return False
+            if self._frame is not None and self._seq != self._consumed_seq:
+                # Previous frame was never picked up by the consumer
+                self.frames_dropped += 1
+            self._frame = frame
+            self._seq += 1
+            self._timestamp = time.time()
+            self.frames_captured += 1
+            self._cond.notify_all()
+        return True
+
+    def read(self, timeout=None):
+        # Block until a frame newer than the last one returned is available
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._seq != self._consumed_seq or not self._running,
+                timeout,
+            ):
+                return False, None
+            if self._frame is None:
+                return False, None
+            self._consumed_seq = self._seq
+            self.read_timestamp = self._timestamp
+            self.read_seq = self._seq
+            self._cond.notify_all()
+            return True, self._frame
+
+    def take(self):
+        # Non-blocking read: (seq, capture time, frame) if a new frame arrived, else None
+        with self._cond:
+            if self._frame is None or self._seq == self._consumed_seq:
+                return None
+            self._consumed_seq = self._seq
+            self._cond.notify_all()
+            return self._seq, self._timestamp, self._frame
+
+    def stats(self):
+        return {
+            "captured": self.frames_captured,
+            "dropped": self.frames_dropped,
+            "reconnects": self.reconnects,
+        }
+
+    def release(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is None:
+            self.cam.release()
+        else:
+            # A thread still blocked in read() releases the capture when it returns
+            self._thread.join(timeout=self.reconnect_delay + 1)
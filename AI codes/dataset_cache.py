@@ -0,0 +1,305 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+from evaluation import (
+    compute_map, label_path, list_images, load_data_yaml, load_labels, result_arrays, split_dir, xywhn_to_xyxy,
+)
+
+DATA_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml")
+CACHE_VERSION = 1  # Bump when the layout below changes
+PAD_VALUE = 114  # Letterbox border, as ultralytics
+
+
+# Cache layout, one directory per split, input size and content hash:
+#   images.u8    (n, imgsz, imgsz, 3) uint8 BGR letterboxed images, memory-mapped
+#   labels.npy   (m, 5) float32 class, cx, cy, w, h normalised to the letterboxed image
+#   offsets.npy  (n + 1,) int64, labels of image i are labels[offsets[i]:offsets[i + 1]]
+#   meta.json    image paths, names, original sizes
+# plus <split>-<imgsz>.manifest.json next to the directories, mapping the
+# last seen file manifest to its content hash.
+
+
+def manifest_key(images, imgsz):
+    # Fast pre-check: only stats the files. Besides size and mtime it covers
+    # the inode and ctime, which copying or restoring files always changes
+    # (ctime can't be set), so preserved mtimes alone don't hide a change
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{imgsz}".encode())
+    for path in images:
+        digest.update(os.path.basename(path).encode())
+        for part in (path, label_path(path)):
+            try:
+                stat = os.stat(part)
+                digest.update(f":{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ctime_ns}:{stat.st_ino}".encode())
+            except FileNotFoundError:
+                digest.update(b":-")
+    return digest.hexdigest()[:16]
+
+
+def content_hash(images, imgsz):
+    # The cache key: changes with any image or label byte, the input size or
+    # the layout. Reads the whole dataset, so it is only recomputed when the
+    # manifest changed or on DatasetCache.open(verify=True)
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{imgsz}".encode())
+    for path in images:
+        digest.update(os.path.basename(path).encode())
+        for part in (path, label_path(path)):
+            if os.path.exists(part):
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def letterbox(image, size, out):
+    # Resize the long side to size, centre and pad into out; returns ratio and padding
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_h, new_w = round(height * ratio), round(width * ratio)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+    interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+    out[:] = PAD_VALUE
+    out[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+    return ratio, left, top
+
+
+def build(images, names, imgsz, directory):
+    # Decode every image once; written to a temporary directory and renamed
+    # so an interrupted build never looks like a valid cache
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    pixels = np.memmap(os.path.join(tmp, "images.u8"), np.uint8, "w+", shape=(len(images), imgsz, imgsz, 3))
+    labels, offsets, shapes = [], [0], []
+    for i, path in enumerate(images):
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"cannot read {path}")
+        height, width = image.shape[:2]
+        ratio, left, top = letterbox(image, imgsz, pixels[i])
+
+        boxes = load_labels(label_path(path)).copy()
+        boxes[:, 1] = (boxes[:, 1] * width * ratio + left) / imgsz
+        boxes[:, 2] = (boxes[:, 2] * height * ratio + top) / imgsz
+        boxes[:, 3] *= width * ratio / imgsz
+        boxes[:, 4] *= height * ratio / imgsz
+        labels.append(boxes)
+        offsets.append(offsets[-1] + len(boxes))
+        shapes.append((height, width))
+    pixels.flush()
+    del pixels
+
+    np.save(os.path.join(tmp, "labels.npy"),
+            np.concatenate(labels) if labels else np.zeros((0, 5), dtype=np.float32))
+    np.save(os.path.join(tmp, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"version": CACHE_VERSION, "imgsz": imgsz, "names": names, "paths": images, "shapes": shapes}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp, directory)
+
+
+class DatasetCache:
+    # Read side of the cache. Images and labels are views into memory-mapped
+    # files: nothing is decoded or allocated per sample, and the OS page
+    # cache keeps hot data in memory across runs.
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.names = meta["names"]
+        self.paths = meta["paths"]
+        self.shapes = meta["shapes"]  # Original (height, width)
+        self.imgsz = meta["imgsz"]
+        # Copy-on-write: in-place augmentations never reach the file
+        self.images = np.memmap(os.path.join(directory, "images.u8"), np.uint8, "c",
+                                shape=(len(self.paths), self.imgsz, self.imgsz, 3))
+        self.labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+
+    @classmethod
+    def open(cls, data_yaml=DATA_YAML, split="train", imgsz=640, cache_dir=None, verify=False, rebuild=False):
+        # Open the cache for a split, building it first if missing or stale.
+        # The cache is keyed by content hash. While the file manifest is the
+        # one recorded for that hash, the hash is reused without reading the
+        # files; a change that keeps size, mtime, ctime and inode of every
+        # file would go unnoticed there, so verify re-hashes regardless.
+        # rebuild always rebuilds.
+        images = list_images(split_dir(data_yaml, split))
+        if not images:
+            raise ValueError(f"no images found for split {split}")
+        _, names = load_data_yaml(data_yaml)
+        cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(data_yaml)), ".dataset-cache")
+
+        manifest_path = os.path.join(cache_dir, f"{split}-{imgsz}.manifest.json")
+        manifest = manifest_key(images, imgsz)
+        content = None
+        if not verify and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                recorded = json.load(f)
+            if recorded["manifest"] == manifest:
+                content = recorded["content"]
+        if content is None:
+            print(f"Hashing {len(images)} {split} images")
+            content = content_hash(images, imgsz)
+
+        directory = os.path.join(cache_dir, f"{split}-{imgsz}-{content}")
+        if rebuild or not os.path.exists(os.path.join(directory, "meta.json")):
+            print(f"Building {split} cache for {len(images)} images in {directory}")
+            # Older builds of the same split are stale now
+            if os.path.isdir(cache_dir):
+                for name in os.listdir(cache_dir):
+                    if name.startswith(f"{split}-{imgsz}-"):
+                        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+            build(images, names, imgsz, directory)
+        with open(manifest_path, "w") as f:
+            json.dump({"manifest": manifest, "content": content}, f)
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        # (letterboxed BGR image, (k, 5) labels), both views
+        return self.images[i], self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        # Contiguous slices of images, in random block order when shuffling,
+        # so every batch is a view rather than a gathered copy
+        starts = np.arange(0, len(self), batch_size)
+        if shuffle:
+            np.random.default_rng(seed).shuffle(starts)
+        for start in starts:
+            end = min(start + batch_size, len(self))
+            yield start, end, self.images[start:end]
+
+
+def evaluate_cached(model, cache, conf=0.001, batch=8):
+    # Same mAP as evaluation.evaluate, on the cached letterboxed images
+    predictions, ground_truths = [], []
+    for start, end, images in cache.batches(batch):
+        results = model.predict(list(images), conf=conf, imgsz=cache.imgsz, verbose=False)
+        for i, result in zip(range(start, end), results):
+            predictions.append(result_arrays(result))
+            labels = cache[i][1]
+            ground_truths.append((xywhn_to_xyxy(labels[:, 1:], cache.imgsz, cache.imgsz), labels[:, 0].astype(int)))
+    return compute_map(predictions, ground_truths, cache.names)
+
+
+def cached_trainer(data_yaml, imgsz, cache_dir=None):
+    # ultralytics DetectionTrainer whose datasets read from the cache instead
+    # of decoding JPEGs; augmentation runs unchanged on the cached images
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class CachedDataset(YOLODataset):
+        def __init__(self, *args, store=None, **kwargs):
+            self.store = store
+            super().__init__(*args, **kwargs)
+
+        def get_img_files(self, img_path):
+            return list(self.store.paths)
+
+        def get_labels(self):
+            size = (self.store.imgsz, self.store.imgsz)
+            labels = []
+            for i, path in enumerate(self.store.paths):
+                boxes = self.store[i][1]
+                labels.append({
+                    "im_file": path,
+                    "shape": size,
+                    "cls": boxes[:, :1],
+                    "bboxes": boxes[:, 1:],
+                    "segments": [],
+                    "keypoints": None,
+                    "normalized": True,
+                    "bbox_format": "xywh",
+                })
+            return labels
+
+        def load_image(self, i, *args, **kwargs):
+            # Already letterboxed to imgsz; (image, original size, resized size).
+            # Keeps BaseDataset.load_image's buffer bookkeeping, which Mosaic
+            # and MixUp draw their partner images from.
+            image = self.store.images[i]
+            if self.augment and self.cache != "ram":
+                self.ims[i], self.im_hw0[i], self.im_hw[i] = image, image.shape[:2], image.shape[:2]
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    j = self.buffer.pop(0)
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+            return image, image.shape[:2], image.shape[:2]
+
+    class CachedTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            split = "train" if mode == "train" else "valid"
+            store = DatasetCache.open(data_yaml, split, imgsz, cache_dir)
+            gs = max(int(self.model.stride.max() if self.model else 0), 32)
+            return CachedDataset(
+                img_path=img_path,
+                imgsz=self.args.imgsz,
+                batch_size=batch,
+                augment=mode == "train",
+                hyp=self.args,
+                rect=mode == "val",
+                cache=False,
+                stride=gs,
+                pad=0.0 if mode == "train" else 0.5,
+                prefix=f"{mode}: ",
+                task="detect",
+                classes=self.args.classes,
+                data=self.data,
+                fraction=self.args.fraction if mode == "train" else 1.0,
+                store=store,
+            )
+
+    return CachedTrainer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the dataset cache, evaluate or train from it")
+    parser.add_argument("command", choices=("build", "eval", "train"))
+    parser.add_argument("--data", default=DATA_YAML)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--cache-dir", help="default: .dataset-cache next to data.yaml")
+    parser.add_argument("--weights", default="tap-n-go-detection.pt")
+    parser.add_argument("--split", default="test", choices=("train", "valid", "test"), help="split to evaluate")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--verify", action="store_true", help="build: re-hash every file even if none looks changed")
+    parser.add_argument("--rebuild", action="store_true", help="build: rebuild even if the cache looks current")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for split in ("train", "valid", "test"):
+            cache = DatasetCache.open(args.data, split, args.imgsz, args.cache_dir, args.verify, args.rebuild)
+            print(f"{split}: {len(cache)} images, {len(cache.labels)} boxes in {cache.directory}")
+
+    elif args.command == "eval":
+        from backends import load_model
+
+        cache = DatasetCache.open(args.data, args.split, args.imgsz, args.cache_dir)
+        result = evaluate_cached(load_model(args.weights), cache, batch=args.batch)
+        print(f"mAP50 {result['map50']:.4f}  mAP50-95 {result['map50_95']:.4f}")
+        for name, stats in result["per_class"].items():
+            print(f"  {name:12s} AP50 {stats['ap50']:.4f}  AP50-95 {stats['ap50_95']:.4f}  ({stats['instances']} boxes)")
+
+    else:
+        trainer = cached_trainer(args.data, args.imgsz, args.cache_dir)(overrides={
+            "model": args.weights,
+            "data": args.data,
+            "imgsz": args.imgsz,
+            "epochs": args.epochs,
+            "batch": args.batch,
+        })
+        trainer.train()
+
+
+if __name__ == "__main__":
+    main()
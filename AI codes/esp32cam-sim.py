@@ -0,0 +1,67 @@
+import argparse
+import os
+import time
+
+import cv2
+
+from evaluation import list_images, split_dir
+from mjpeg import MJPEGServer
+
+# ESP32-CAM frame sizes (camera.FRAME_*)
+FRAMESIZES = {
+    "QVGA": (320, 240),
+    "VGA": (640, 480),
+    "SVGA": (800, 600),
+    "XGA": (1024, 768),
+    "HD": (1280, 720),
+    "SXGA": (1280, 1024),
+    "UXGA": (1600, 1200),
+}
+
+
+def encode_frames(paths, size, quality):
+    # Pre-encode the dataset once so serving costs no CPU per client
+    jpegs = []
+    for path in paths:
+        frame = cv2.resize(cv2.imread(path), size, interpolation=cv2.INTER_LINEAR)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            jpegs.append(buf.tobytes())
+    return jpegs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual ESP32-CAM boards streaming the bundled dataset")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml"))
+    parser.add_argument("--split", default="test", choices=("train", "valid", "test"))
+    parser.add_argument("--framesize", default="UXGA", choices=sorted(FRAMESIZES))
+    parser.add_argument("--quality", type=int, default=90, help="OpenCV JPEG quality (0-100)")
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--cameras", type=int, default=1, help="number of virtual cameras")
+    parser.add_argument("--port", type=int, default=8081, help="port of the first camera")
+    args = parser.parse_args()
+
+    paths = list_images(split_dir(args.data, args.split))
+    jpegs = encode_frames(paths, FRAMESIZES[args.framesize], args.quality)
+    print(f"{len(jpegs)} frames at {args.framesize}, "
+          f"avg {sum(map(len, jpegs)) / len(jpegs) / 1024:.0f} KiB per frame")
+
+    # One server per camera, on consecutive ports
+    servers = [MJPEGServer(jpegs, port=args.port + i, fps=args.fps).start() for i in range(args.cameras)]
+    urls = [f"http://127.0.0.1:{server.port}/stream" for server in servers]
+    print("ESP32_CAM_URLS=" + ",".join(urls))
+
+    try:
+        while True:
+            time.sleep(10)
+            clients = sum(server.clients for server in servers)
+            sent = sum(server.frames_sent for server in servers)
+            print(f"{clients} clients connected, {sent} frames sent")
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import glob
+import os
+
+import numpy as np
+import yaml
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# np.trapz was renamed in NumPy 2.0
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def load_data_yaml(data_yaml):
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    names = data["names"]
+    if isinstance(names, dict):
+        names = [names[i] for i in sorted(names)]
+    return data, list(names)
+
+
+def split_dir(data_yaml, split):
+    # Resolve a split from data.yaml the way ultralytics does: relative to the
+    # yaml file, dropping a leading "../" (Roboflow exports) if that fails
+    data, _ = load_data_yaml(data_yaml)
+    key = "val" if split == "valid" else split
+    root = os.path.dirname(os.path.abspath(data_yaml))
+    path = os.path.normpath(os.path.join(root, data[key]))
+    if not os.path.isdir(path) and data[key].startswith("../"):
+        path = os.path.normpath(os.path.join(root, data[key][3:]))
+    return path
+
+
+def label_path(image_path):
+    # YOLO convention: .../images/name.jpg -> .../labels/name.txt
+    head, name = os.path.split(image_path)
+    labels_dir = os.path.join(os.path.dirname(head), "labels")
+    return os.path.join(labels_dir, os.path.splitext(name)[0] + ".txt")
+
+
+def list_images(images_dir):
+    return sorted(
+        path for path in glob.glob(os.path.join(images_dir, "*"))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_labels(path):
+    # (n, 5) float32 array of class, cx, cy, w, h (normalised); empty if no file
+    if not os.path.exists(path):
+        return np.zeros((0, 5), dtype=np.float32)
+    labels = np.loadtxt(path, dtype=np.float32, ndmin=2)
+    return labels.reshape(-1, 5) if labels.size else np.zeros((0, 5), dtype=np.float32)
+
+
+def xywhn_to_xyxy(boxes, width, height):
+    cx, cy, w, h = boxes[:, 0] * width, boxes[:, 1] * height, boxes[:, 2] * width, boxes[:, 3] * height
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def box_iou(a, b):
+    # Pairwise IoU between (n, 4) and (m, 4) xyxy boxes
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def average_precision(recall, precision):
+    # Area under the interpolated PR curve, 101-point COCO style (as ultralytics)
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return trapezoid(np.interp(x, mrec, mpre), x)
+
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls, iou_thresholds):
+    # (n_pred, n_thresholds) bool array: prediction is a true positive at that IoU
+    correct = np.zeros((len(pred_boxes), len(iou_thresholds)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return correct
+    iou = box_iou(pred_boxes, gt_boxes) * (pred_cls[:, None] == gt_cls[None, :])
+    for t, threshold in enumerate(iou_thresholds):
+        pairs = np.argwhere(iou >= threshold)
+        if not len(pairs):
+            continue
+        # Greedy one-to-one matching, highest IoU first
+        pairs = pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]])]
+        pairs = pairs[np.unique(pairs[:, 1], return_index=True)[1]]
+        pairs = pairs[np.unique(pairs[:, 0], return_index=True)[1]]
+        correct[pairs[:, 0], t] = True
+    return correct
+
+
+def compute_map(predictions, ground_truths, names, iou_thresholds=None):
+    # predictions: per image (xyxy boxes, confidences, classes)
+    # ground_truths: per image (xyxy boxes, classes)
+    if iou_thresholds is None:
+        iou_thresholds = np.linspace(0.5, 0.95, 10)
+
+    all_correct, all_conf, all_cls, all_gt_cls = [], [], [], []
+    for (boxes, conf, cls), (gt_boxes, gt_cls) in zip(predictions, ground_truths):
+        all_correct.append(match_predictions(boxes, cls, gt_boxes, gt_cls, iou_thresholds))
+        all_conf.append(conf)
+        all_cls.append(cls)
+        all_gt_cls.append(gt_cls)
+
+    correct = np.concatenate(all_correct) if all_correct else np.zeros((0, len(iou_thresholds)), bool)
+    conf = np.concatenate(all_conf) if all_conf else np.zeros(0)
+    cls = np.concatenate(all_cls) if all_cls else np.zeros(0)
+    gt_cls = np.concatenate(all_gt_cls) if all_gt_cls else np.zeros(0)
+
+    order = np.argsort(-conf)
+    correct, cls = correct[order], cls[order]
+
+    per_class = {}
+    ap = []
+    for c, name in enumerate(names):
+        n_gt = int((gt_cls == c).sum())
+        if n_gt == 0:
+            continue
+        hits = correct[cls == c]
+        tp = np.cumsum(hits, axis=0)
+        fp = np.cumsum(~hits, axis=0)
+        class_ap = np.zeros(len(iou_thresholds))
+        for t in range(len(iou_thresholds)):
+            if not len(hits):
+                continue
+            recall = tp[:, t] / n_gt
+            precision = tp[:, t] / (tp[:, t] + fp[:, t])
+            class_ap[t] = average_precision(recall, precision)
+        ap.append(class_ap)
+        per_class[name] = {"ap50": float(class_ap[0]), "ap50_95": float(class_ap.mean()), "instances": n_gt}
+
+    ap = np.array(ap) if ap else np.zeros((1, len(iou_thresholds)))
+    return {
+        "map50": float(ap[:, 0].mean()),
+        "map50_95": float(ap.mean()),
+        "per_class": per_class,
+    }
+
+
+def result_arrays(result):
+    # (xyxy, conf, cls) numpy arrays from an ultralytics Results object
+    boxes = result.boxes
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+
+def evaluate(model, images, conf=0.001, batch=8, imgsz=640):
+    # mAP of a YOLO model over a list of image paths with YOLO label files
+    predictions, ground_truths = [], []
+    for start in range(0, len(images), batch):
+        paths = images[start:start + batch]
+        results = model.predict(paths, conf=conf, imgsz=imgsz, verbose=False)
+        for path, result in zip(paths, results):
+            predictions.append(result_arrays(result))
+            height, width = result.orig_shape
+            labels = load_labels(label_path(path))
+            ground_truths.append((xywhn_to_xyxy(labels[:, 1:], width, height), labels[:, 0].astype(int)))
+    return compute_map(predictions, ground_truths, [model.names[i] for i in sorted(model.names)])
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+
+from payload import decode
+
+# Simulated Tap N Go kiosks (IoT Codes/esp32.py) subscribing to detection
+# results. For load tests run a local broker, e.g. `mosquitto -p 1883`,
+# and point both the detector and this script at it with MQTT_SERVER=localhost.
+
+load_dotenv()
+
+
+class VirtualKiosk:
+    def __init__(self, index, server, port, topic, request_topic=None, latency_topic=None, request_timeout=12):
+        self.kiosk_id = f"kiosk-sim-{index}-{uuid.uuid4().hex[:6]}"
+        # Triggered mode: send detect requests and listen on our reply topic
+        self.request_topic = request_topic
+        self.topic = f"{topic}/{self.kiosk_id}" if request_topic else topic
+        self.messages = 0
+        self.last_message = None
+        self.gaps = []  # Seconds between consecutive messages
+        self.session = None
+        self.requested_at = 0.0
+        self.response_times = []  # Seconds from request to matching reply
+        self.request_timeout = request_timeout  # Firmware's PROCESSING_TIMEOUT_MS
+        self.timeouts = 0  # Requests abandoned without a reply
+        self.latency_topic = latency_topic  # Where to report receive times, like the firmware
+        self.lock = threading.Lock()
+
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.kiosk_id
+        )
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(server, port)
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        client.subscribe(self.topic)
+
+    def on_message(self, client, userdata, msg):
+        now = time.time()
+        with self.lock:
+            if self.last_message is not None:
+                self.gaps.append(now - self.last_message)
+            self.last_message = now
+            self.messages += 1
+
+            try:
+                message = decode(msg.payload)
+            except ValueError:
+                return
+            if self.session is not None:
+                if message.get("session") != self.session:
+                    return
+                self.response_times.append(now - self.requested_at)
+                self.session = None
+
+        if self.latency_topic and message.get("v", 0) >= 1:
+            report = {
+                "kiosk": self.kiosk_id,
+                "seq": message["seq"],
+                "t_cap": message["t_cap"],
+                "t_pub": message["t_pub"],
+                "t_rx": int(now * 1000),
+            }
+            self.client.publish(self.latency_topic, json.dumps(report))
+
+    def request(self):
+        # Same request the kiosk firmware sends when Yellow is pressed
+        with self.lock:
+            if self.session is not None:
+                if time.time() - self.requested_at < self.request_timeout:
+                    return
+                # Reply lost or never sent; give up like the firmware does
+                self.timeouts += 1
+            self.session = uuid.uuid4().hex[:8]
+            self.requested_at = time.time()
+            payload = json.dumps({"kiosk": self.kiosk_id, "session": self.session})
+        self.client.publish(self.request_topic, payload, qos=1)
+
+    def report(self):
+        with self.lock:
+            gaps, self.gaps = self.gaps, []
+            responses, self.response_times = self.response_times, []
+            timeouts, self.timeouts = self.timeouts, 0
+            messages = self.messages
+        mean_gap = sum(gaps) / len(gaps) if gaps else 0.0
+        return messages, mean_gap, responses, timeouts
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated kiosks subscribed to detection results")
+    parser.add_argument("--server", default=os.getenv("MQTT_SERVER", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", 1883)))
+    parser.add_argument("--topics", default=os.getenv("MQTT_TOPIC", "/predict/classes"),
+                        help="comma-separated topics, assigned to kiosks round-robin")
+    parser.add_argument("--kiosks", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=10, help="report interval in seconds")
+    parser.add_argument("--triggered", action="store_true",
+                        help="send detect requests instead of listening to broadcasts")
+    parser.add_argument("--request-topic", default=os.getenv("MQTT_REQUEST_TOPIC", "/predict/request"))
+    parser.add_argument("--request-interval", type=float, default=5,
+                        help="seconds between detect requests per kiosk")
+    parser.add_argument("--request-timeout", type=float, default=12,
+                        help="seconds before an unanswered request is abandoned, as on the kiosk")
+    parser.add_argument("--latency-topic", default=os.getenv("MQTT_LATENCY_TOPIC", "/predict/latency"),
+                        help="topic for latency reports, empty to disable")
+    args = parser.parse_args()
+
+    topics = [topic.strip() for topic in args.topics.split(",") if topic.strip()]
+    request_topic = args.request_topic if args.triggered else None
+    kiosks = [
+        VirtualKiosk(i, args.server, args.port, topics[i % len(topics)], request_topic, args.latency_topic,
+                     args.request_timeout)
+        for i in range(args.kiosks)
+    ]
+
+    try:
+        next_report = time.time() + args.interval
+        while True:
+            if args.triggered:
+                for kiosk in kiosks:
+                    kiosk.request()
+                time.sleep(min(args.request_interval, args.interval))
+            else:
+                time.sleep(args.interval)
+            if time.time() < next_report:
+                continue
+            next_report += args.interval
+
+            reports = [kiosk.report() for kiosk in kiosks]
+            total = sum(messages for messages, _, _, _ in reports)
+            gaps = [gap for _, gap, _, _ in reports if gap]
+            mean_gap = sum(gaps) / len(gaps) if gaps else 0.0
+            line = f"{len(kiosks)} kiosks, {total} messages received, mean gap {mean_gap:.2f} s"
+            responses = sorted(t for _, _, times, _ in reports for t in times)
+            if responses:
+                line += (f", {len(responses)} replies, median {responses[len(responses) // 2] * 1000:.0f} ms,"
+                         f" max {responses[-1] * 1000:.0f} ms")
+            timeouts = sum(count for _, _, _, count in reports)
+            if timeouts:
+                line += f", {timeouts} requests timed out"
+            print(line)
+    except KeyboardInterrupt:
+        pass
+    for kiosk in kiosks:
+        kiosk.close()
+
+
+if __name__ == "__main__":
+    main()
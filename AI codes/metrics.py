@@ -0,0 +1,120 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Metrics:
+    # Per-stage timing histograms for the detector hot path. Recording a
+    # stage is a perf_counter() call and a few integer increments, cheap
+    # enough to leave enabled. Histograms are exported in Prometheus text
+    # format; every frame can also be appended to a JSON-lines trace file.
+
+    def __init__(self, prefix="detector", trace_path=None):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, "a", buffering=1 << 16) if trace_path else None
+        self._server = None
+
+    @classmethod
+    def from_env(cls, env, prefix="detector"):
+        # METRICS_PORT serves /metrics, TRACE_FILE enables the per-frame trace
+        metrics = cls(prefix, trace_path=env.get("TRACE_FILE") or None)
+        if env.get("METRICS_PORT"):
+            metrics.serve(int(env["METRICS_PORT"]))
+        return metrics
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage, frame_stages=None):
+        # Times the block; also stores the duration in frame_stages if given
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(stage, seconds)
+            if frame_stages is not None:
+                frame_stages[stage] = seconds
+
+    def trace(self, frame_stages, **fields):
+        if self._trace is None:
+            return
+        line = {"t": time.time(), **fields, "ms": {k: round(v * 1000, 3) for k, v in frame_stages.items()}}
+        with self._lock:
+            self._trace.write(json.dumps(line) + "\n")
+
+    def prometheus(self):
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            for counter, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {self.prefix}_{counter} counter")
+                lines.append(f"{self.prefix}_{counter} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._trace is not None:
+            self._trace.close()
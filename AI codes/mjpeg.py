@@ -0,0 +1,260 @@
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+# Multipart framing used by the ESP32-CAM server (IoT Codes/esp32cam.py)
+BOUNDARY = "123456789000000000000987654321"
+STREAM_CONTENT_TYPE = "multipart/x-mixed-replace;boundary=" + BOUNDARY
+STREAM_BOUNDARY = "\r\n--" + BOUNDARY + "\r\n"
+STREAM_PART = "Content-Type: image/jpeg\r\nContent-Length: %s\r\n\r\n"
+
+INDEX_HTML = """<html>
+<head><title>ESP32-CAM Stream</title></head>
+<body>
+<h1>ESP32-CAM Stream</h1>
+<img src="/stream" width="640" height="480">
+</body>
+</html>"""
+
+
+# libjpeg can decode at 1/2, 1/4 and 1/8 scale by dropping DCT coefficients,
+# which is much cheaper than a full decode followed by a resize
+REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+MAX_LINE = 1024  # Longest boundary or header line accepted
+MAX_PART = 4 << 20  # Largest JPEG accepted, in bytes
+
+
+def encode_part(jpeg):
+    # One frame of the stream, exactly as the ESP32-CAM sends it
+    return STREAM_BOUNDARY.encode() + (STREAM_PART % len(jpeg)).encode() + jpeg
+
+
+def jpeg_size(data):
+    # (width, height) from the JPEG's SOF header, None if it can't be found
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def decode_jpeg(data, min_size=0):
+    # Decode at the smallest scale whose long side still covers min_size
+    # (the model input size), e.g. UXGA at 1/2 for 640; 0 decodes full size
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(data) if min_size else None
+    if size:
+        for factor, reduced in REDUCED_DECODE:
+            if max(size) // factor >= min_size:
+                flag = reduced
+                break
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+
+
+class MJPEGClient:
+    # cv2.VideoCapture look-alike that reads a multipart/x-mixed-replace
+    # stream (as served by IoT Codes/esp32cam.py) over one persistent HTTP
+    # connection. Lines and parts are read with hard size limits, and each
+    # JPEG is decoded at reduced scale when min_size allows it.
+
+    def __init__(self, url, min_size=0, timeout=10):
+        self.url = url
+        self.min_size = min_size
+        self.timeout = timeout
+        self.response = None
+        self.delimiter = None
+        self._after_delimiter = False  # The next part's delimiter line was already read
+        self._open()
+
+    def _open(self):
+        try:
+            response = urllib.request.urlopen(self.url, timeout=self.timeout)
+        except OSError as e:
+            print("MJPEG connection failed:", e)
+            return
+        content_type = response.headers.get("Content-Type", "")
+        boundary = None
+        for param in content_type.split(";")[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "boundary":
+                boundary = value.strip('"')
+        if not content_type.startswith("multipart/") or not boundary:
+            print("Not an MJPEG stream:", content_type)
+            response.close()
+            return
+        # Some servers already include the leading dashes in the parameter
+        self.delimiter = boundary.encode() if boundary.startswith("--") else b"--" + boundary.encode()
+        self.response = response
+
+    def isOpened(self):
+        return self.response is not None
+
+    def _readline(self):
+        line = self.response.readline(MAX_LINE)
+        if not line:
+            raise EOFError("stream ended")
+        return line.strip()
+
+    def _read_part(self):
+        if not self._after_delimiter:
+            while not self._readline().startswith(self.delimiter):
+                pass
+        self._after_delimiter = False
+        length = None
+        while True:
+            line = self._readline()
+            if not line:
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        if length is None:
+            return self._read_until_boundary()
+        if length > MAX_PART:
+            raise ValueError(f"part of {length} bytes")
+        data = self.response.read(length)
+        if len(data) < length:
+            raise EOFError("stream ended inside a frame")
+        return data
+
+    def _read_until_boundary(self):
+        # Parts without Content-Length end at the next delimiter line
+        data = bytearray()
+        while len(data) <= MAX_PART:
+            line = self.response.readline(MAX_LINE)
+            if not line:
+                raise EOFError("stream ended inside a frame")
+            if line.startswith(self.delimiter):
+                self._after_delimiter = True
+                return bytes(data).rstrip(b"\r\n")
+            data += line
+        raise ValueError("part without Content-Length is too large")
+
+    def read(self, image=None):
+        # image is accepted for cv2 compatibility; imdecode can't fill it in place
+        if self.response is None:
+            return False, None
+        try:
+            data = self._read_part()
+        except (OSError, ValueError, EOFError) as e:
+            print("MJPEG stream error:", e)
+            self.release()
+            return False, None
+        frame = decode_jpeg(data, self.min_size)
+        return frame is not None, frame
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+
+class MJPEGServer:
+    # Serves a list of pre-encoded JPEG frames as an ESP32-CAM style MJPEG
+    # stream on /stream (paced at fps, looping) and single frames on /capture.
+    # Every client gets its own position in the sequence.
+
+    def __init__(self, jpegs, port=0, fps=10, loop=True, host="0.0.0.0"):
+        self.jpegs = jpegs
+        self.fps = fps
+        self.loop = loop
+        self.clients = 0
+        self.frames_sent = 0
+        self._lock = threading.Lock()
+        self._next_capture = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/stream":
+                    server._stream(self)
+                elif path == "/capture":
+                    server._capture(self)
+                else:
+                    server._index(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mjpeg-server", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/stream"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _index(self, handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/html")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.wfile.write(INDEX_HTML.encode())
+
+    def _capture(self, handler):
+        with self._lock:
+            jpeg = self.jpegs[self._next_capture % len(self.jpegs)]
+            self._next_capture += 1
+        handler.send_response(200)
+        handler.send_header("Content-Type", "image/jpeg")
+        handler.send_header("Content-Length", str(len(jpeg)))
+        handler.end_headers()
+        handler.wfile.write(jpeg)
+
+    def _stream(self, handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", STREAM_CONTENT_TYPE)
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        with self._lock:
+            self.clients += 1
+        interval = 1 / self.fps if self.fps else 0
+        next_frame = time.monotonic()
+        index = 0
+        try:
+            while self.loop or index < len(self.jpegs):
+                handler.wfile.write(encode_part(self.jpegs[index % len(self.jpegs)]))
+                handler.wfile.flush()
+                index += 1
+                with self._lock:
+                    self.frames_sent += 1
+
+                # Fixed-rate pacing that doesn't drift with send time
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._lock:
+                self.clients -= 1
+
+    def close(self):
+        if self._thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
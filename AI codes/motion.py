@@ -0,0 +1,58 @@
+import time
+
+import cv2
+
+
+class SceneGate:
+    # Cheap scene-change test run before inference. Each frame is reduced to
+    # a small grayscale thumbnail and compared with the thumbnail of the
+    # last frame that was actually inferred; if the mean absolute difference
+    # stays under threshold the previous detections can be reused. A refresh
+    # is forced once the reused result is older than max_age seconds.
+
+    def __init__(self, threshold=6.0, max_age=2.0, size=(64, 48)):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.size = size
+
+        self.reference = None
+        self.reference_time = 0.0
+
+        self.checked = 0
+        self.skipped = 0
+
+    def thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        # Light blur so sensor noise and JPEG artefacts don't count as motion
+        return cv2.GaussianBlur(small, (3, 3), 0)
+
+    def should_infer(self, frame, now=None):
+        now = time.time() if now is None else now
+        thumb = self.thumbnail(frame)
+        self.checked += 1
+
+        if self.reference is not None and now - self.reference_time < self.max_age:
+            if cv2.absdiff(thumb, self.reference).mean() < self.threshold:
+                self.skipped += 1
+                return False
+
+        self.reference = thumb
+        self.reference_time = now
+        return True
+
+    def update_reference(self, frame, now=None):
+        # Frame was inferred without asking the gate (e.g. an open request);
+        # later frames are compared with it
+        self.reference = self.thumbnail(frame)
+        self.reference_time = time.time() if now is None else now
+
+    def skip_ratio(self):
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skip_ratio(), 3),
+        }
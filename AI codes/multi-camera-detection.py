@@ -0,0 +1,161 @@
+import paho.mqtt.client as mqtt
+import threading
+import time
+import os
+from dotenv import load_dotenv
+from capture import FrameGrabber
+from publisher import DetectionPublisher
+from sessions import SessionManager
+from payload import FrameDetections
+from roi import parse_rois
+from backends import load_model, model_path_from_env
+
+load_dotenv()
+
+# Cameras and their MQTT topics, e.g.
+# ESP32_CAM_URLS="http://10.0.0.11/stream,http://10.0.0.12/stream"
+# MQTT_TOPICS="/kiosk1/predict/classes,/kiosk2/predict/classes"
+CAM_URLS = [url.strip() for url in os.getenv("ESP32_CAM_URLS", "").split(",") if url.strip()]
+TOPICS = [topic.strip() for topic in os.getenv("MQTT_TOPICS", "").split(",") if topic.strip()]
+
+if not CAM_URLS or len(CAM_URLS) != len(TOPICS):
+    print("ESP32_CAM_URLS and MQTT_TOPICS must list one topic per camera")
+    exit()
+
+# Kiosk client ids in the same order, for detect requests (unset: any camera
+# may answer any kiosk)
+KIOSKS = [kiosk.strip() for kiosk in os.getenv("CAMERA_KIOSKS", "").split(",") if kiosk.strip()]
+if KIOSKS and len(KIOSKS) != len(CAM_URLS):
+    print("CAMERA_KIOSKS must list one kiosk id per camera")
+    exit()
+
+# Batching Variables
+MAX_BATCH = int(os.getenv("MAX_BATCH", len(CAM_URLS)))
+MAX_BATCH_LATENCY = float(os.getenv("MAX_BATCH_LATENCY_MS", 50)) / 1000  # Seconds
+
+REPORT_INTERVAL = 10  # Seconds
+
+# MQTT setup
+mqttc = mqtt.Client(
+    mqtt.CallbackAPIVersion.VERSION2,
+    client_id=os.getenv("CLIENT_ID")
+)
+mqttc.connect(os.getenv("MQTT_SERVER"), int(os.getenv("MQTT_PORT")))
+mqttc.loop_start()
+
+# YOLOv8 Model (one copy of the weights for every camera)
+model = load_model(model_path_from_env('tap-n-go-detection.pt', os.environ))
+
+# Camera Setup, each grabber wakes the batcher when it has a new frame
+# (JPEGs decoded at reduced scale down to DECODE_SIZE, see object-detection.py)
+frame_ready = threading.Event()
+DECODE_SIZE = None if os.getenv("OPENCV_CAPTURE", "0") == "1" else int(os.getenv("DECODE_SIZE", 640))
+cams = [FrameGrabber(url, on_frame=frame_ready.set, decode_size=DECODE_SIZE) for url in CAM_URLS]
+
+# Per-camera tray regions, "x1,y1,x2,y2;x1,y1,x2,y2;..." in ESP32_CAM_URLS order
+ROIS = parse_rois(os.getenv("CAMERA_ROIS"), len(CAM_URLS))
+for url, cam in zip(CAM_URLS, cams):
+    if not cam.isOpened():
+        print("Failed to connect to camera stream:", url)
+    cam.start()
+
+
+class CameraStats:
+    def __init__(self):
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add(self, latency):
+        self.frames += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def report(self, elapsed):
+        fps = self.frames / elapsed
+        mean = self.latency_sum / self.frames * 1000 if self.frames else 0.0
+        line = f"{fps:5.1f} FPS, latency mean {mean:6.1f} ms, max {self.latency_max * 1000:6.1f} ms"
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        return line
+
+
+stats = [CameraStats() for _ in cams]
+publishers = [DetectionPublisher.from_env(mqttc, topic, os.environ) for topic in TOPICS]
+# Kiosk detect requests, answered from the camera watching that kiosk's tray
+sessions = SessionManager.from_env(mqttc, os.environ)
+pending = {}  # camera index -> (capture time, frame, seq)
+last_report = time.time()
+
+
+def batch_deadline():
+    # A batch is due MAX_BATCH_LATENCY after its oldest frame was captured,
+    # however long that frame has already waited behind earlier batches
+    return min(captured_at for captured_at, _, _ in pending.values()) + MAX_BATCH_LATENCY
+
+
+try:
+    while True:
+        timeout = max(batch_deadline() - time.time(), 0) if pending else MAX_BATCH_LATENCY
+        frame_ready.wait(timeout)
+        frame_ready.clear()
+
+        # Collect the newest frame of every camera not already waiting in the batch
+        for i, cam in enumerate(cams):
+            if i in pending:
+                continue
+            item = cam.take()
+            if item is not None:
+                seq, captured_at, frame = item
+                pending[i] = (captured_at, frame, seq)
+
+        if not pending:
+            continue
+
+        # Dispatch when the batch is full, every camera is in, or the oldest frame hit its deadline
+        now = time.time()
+        if len(pending) < min(MAX_BATCH, len(cams)) and now < batch_deadline():
+            continue
+
+        # Oldest frames first so no camera is starved when MAX_BATCH < cameras
+        batch = sorted(pending.items(), key=lambda item: item[1][0])[:MAX_BATCH]
+        for i, _ in batch:
+            del pending[i]
+
+        # YOLOv8 Inference over the whole batch
+        # Each camera's tray region only, letterboxed by ultralytics
+        results = model.predict(
+            [ROIS[i].crop(frame) if ROIS[i] else frame for i, (_, frame, _) in batch],
+            conf=0.6,
+            verbose=False,
+        )
+        done = time.time()
+
+        # Route each camera's classes to its own topic
+        for (i, (captured_at, frame, seq)), result in zip(batch, results):
+            stats[i].add(done - captured_at)
+            if ROIS[i] is not None:
+                # Boxes in full-frame coordinates, as in object-detection.py
+                ROIS[i].map_back(result, frame.shape)
+
+            detections = FrameDetections(seq, captured_at, done)
+            for box in result.boxes:
+                cls_id = int(box.cls.item())
+                detections.add(model.names[cls_id], float(box.conf.item()))
+
+            publishers[i].update(detections.classes, now=done, detections=detections)
+            sessions.update(detections, now=done, kiosks={KIOSKS[i]} if KIOSKS else None)
+
+        # Per-camera FPS and latency report
+        if done - last_report >= REPORT_INTERVAL:
+            elapsed = done - last_report
+            for url, cam, cam_stats in zip(CAM_URLS, cams, stats):
+                print(f"[{url}] {cam_stats.report(elapsed)}, capture {cam.stats()}")
+            last_report = done
+except KeyboardInterrupt:
+    pass
+
+for cam in cams:
+    cam.release()
+mqttc.loop_stop()
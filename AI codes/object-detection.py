@@ -1,12 +1,39 @@
-from ultralytics import YOLO
 import cv2
 import paho.mqtt.client as mqtt
 import time
 import os
 from dotenv import load_dotenv
+from capture import FrameGrabber
+from shared_frames import CaptureProcess
+from restream import MJPEGRestream
+from publisher import DetectionPublisher
+from motion import SceneGate
+from metrics import Metrics
+from sessions import SessionManager
+from payload import FrameDetections, LatencyTracker
+from roi import Roi
+from backends import load_model, model_path_from_env
 
 load_dotenv()
 
+# Stage timings (METRICS_PORT for Prometheus, TRACE_FILE for a JSON-lines trace)
+metrics = Metrics.from_env(os.environ)
+
+# ESP32-CAM Setup (frames are pulled on a background thread, or with
+# CAPTURE_PROCESS=1 in a separate process that shares frames through shared
+# memory; that process is forked, so it is started before MQTT and the model)
+# JPEGs are decoded at 1/2 or 1/4 scale when that still covers DECODE_SIZE,
+# the model input size; OPENCV_CAPTURE=1 goes back to cv2.VideoCapture
+DECODE_SIZE = None if os.getenv("OPENCV_CAPTURE", "0") == "1" else int(os.getenv("DECODE_SIZE", 640))
+if os.getenv("CAPTURE_PROCESS", "0") == "1":
+    cam = CaptureProcess(os.getenv("ESP32_CAM_URL"), metrics=metrics, decode_size=DECODE_SIZE)
+else:
+    cam = FrameGrabber(os.getenv("ESP32_CAM_URL"), metrics=metrics, decode_size=DECODE_SIZE)
+
+if not cam.isOpened():
+    print("Failed to connect to ESP32-CAM stream")
+    exit()
+
 # MQTT setup
 mqttc = mqtt.Client(
     mqtt.CallbackAPIVersion.VERSION2,
@@ -16,49 +43,138 @@ mqttc.connect(os.getenv("MQTT_SERVER"), int(os.getenv("MQTT_PORT")))
 mqttc.loop_start()
 
 # YOLOv8 Model
-model = YOLO('tap-n-go-detection.pt')
+# (MODEL_BACKEND=onnx|openvino|openvino-int8 exports once, gated on test mAP)
+model = load_model(model_path_from_env('tap-n-go-detection.pt', os.environ))
 
-# ESP32-CAM Setup
-cam = cv2.VideoCapture(os.getenv("ESP32_CAM_URL"))
+cam.start()
 
-if not cam.isOpened():
-    print("Failed to connect to ESP32-CAM stream")
-    exit()
+# Display Settings
+HEADLESS = os.getenv("HEADLESS", "0") == "1"  # No window, no per-frame annotation
+RESTREAM_PORT = os.getenv("RESTREAM_PORT")  # Optional annotated MJPEG endpoint
+restream = None
+if RESTREAM_PORT:
+    restream = MJPEGRestream(int(RESTREAM_PORT), max_fps=float(os.getenv("RESTREAM_FPS", 5)))
+    print("Annotated stream on port", RESTREAM_PORT)
+
+# Scene-change gating: reuse the last detections while nothing moves
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", 6))  # 0 disables gating
+gate = SceneGate(MOTION_THRESHOLD, max_age=float(os.getenv("MOTION_MAX_AGE", 2)))
+STATS_INTERVAL = 60  # Seconds
+last_stats_time = time.time()
+
+# Tray region "x1,y1,x2,y2" (normalised); only this part is gated and inferred
+# (python roi.py derives one from the labelled dataset)
+ROI = Roi.parse(os.getenv("ROI"))
+
+# Change-driven MQTT Publishing (k-of-n frame vote plus heartbeat)
+publisher = DetectionPublisher.from_env(mqttc, os.getenv("MQTT_TOPIC"), os.environ)
+
+# Kiosk detect requests are always answered; triggered mode also idles the
+# camera and skips broadcasting while no request is open
+TRIGGERED = os.getenv("TRIGGERED", "0") == "1"
+sessions = SessionManager.from_env(mqttc, os.environ)
+idle = False
+
+# Kiosks report when they act on a message (camera-to-kiosk latency)
+latency = LatencyTracker(mqttc, os.getenv("MQTT_LATENCY_TOPIC", "/predict/latency"), metrics)
+
+try:
+    while True:
+        stages = {}  # Stage durations of this frame, in seconds
+
+        # Idle (stream closed) until a kiosk asks for a detection
+        if TRIGGERED and not sessions.active():
+            if not idle:
+                cam.pause()
+                idle = True
+            if not sessions.wait(timeout=1):
+                continue
+        if idle:
+            cam.resume()
+            idle = False
+
+        # Newest frame only; reconnects are handled by the grabber thread
+        with metrics.span("capture", stages):
+            ret, frame = cam.read(timeout=1)
+        if not ret:
+            continue
+        loop_start = time.perf_counter()
+
+        # YOLOv8 Inference, skipped when the scene hasn't changed (an open
+        # request needs fresh frames, so it always infers)
+        tray = ROI.crop(frame) if ROI is not None else frame
+        with metrics.span("gate", stages):
+            forced = TRIGGERED or sessions.active()
+            infer = forced or MOTION_THRESHOLD <= 0 or gate.should_infer(tray)
+            if forced and MOTION_THRESHOLD > 0:
+                # Keep the gate's reference current for when gating resumes
+                gate.update_reference(tray)
+        if infer:
+            results = model.predict(tray, conf=0.6)
+            # ultralytics times preprocess/inference/postprocess itself (ms)
+            for stage, ms in results[0].speed.items():
+                stages[stage] = ms / 1000
+                metrics.observe(stage, ms / 1000)
+            if ROI is not None:
+                # Boxes in full-frame coordinates for the overlay
+                ROI.map_back(results[0], frame.shape)
+
+            # Process Results (counts, confidences and timestamps go into the payload)
+            with metrics.span("classes", stages):
+                detections = FrameDetections(cam.read_seq, cam.read_timestamp, time.time())
+                for result in results:
+                    for box in result.boxes:
+                        cls_id = int(box.cls.item())
+                        detections.add(model.names[cls_id], float(box.conf.item()))
+                detected_classes = detections.classes
+        else:
+            metrics.increment("frames_skipped_total")
+
+        with metrics.span("publish", stages):
+            # Reply to requesting kiosks once the result is confident
+            sessions.update(detections)
+            if not TRIGGERED:
+                # Publish as soon as the stable class set changes
+                publisher.update(detected_classes, detections=detections)
+
+        # Duty-cycle report
+        current_time = time.time()
+        if current_time - last_stats_time >= STATS_INTERVAL:
+            print("Scene gate:", gate.stats(), "capture:", cam.stats())
+            last_stats_time = current_time
+
+        # Annotate only when somebody will see it
+        annotated_frame = None
+        if restream is not None and restream.wants_frame():
+            with metrics.span("plot", stages):
+                # Latest detections drawn on the current frame (they may be
+                # from an earlier frame when the scene gate skipped inference)
+                annotated_frame = results[0].plot(img=frame)
+            restream.update(annotated_frame)
+
+        # Display Annotated Frame
+        if not HEADLESS:
+            if annotated_frame is None:
+                with metrics.span("plot", stages):
+                    annotated_frame = results[0].plot(img=frame)
+            with metrics.span("display", stages):
+                cv2.imshow('ESP32-CAM Feed', annotated_frame)
+                key = cv2.waitKey(1)
+            if key == ord('q'):
+                break
 
-# Throttling Variables
-last_publish_time = 0
-PUBLISH_INTERVAL = 3  # Seconds
-
-while True:
-    ret, frame = cam.read()
-    if not ret:
-        print("Frame retrieval error, trying to reconnect...")
-        cam.release()
-        time.sleep(2)
-        cam = cv2.VideoCapture(os.getenv("ESP32_CAM_URL"))
-        continue
-
-    # YOLOv8 Inference
-    results = model.predict(frame, conf=0.6)
-    detected_classes = set()
-
-    # Process Results
-    for result in results:
-        for box in result.boxes:
-            cls_id = int(box.cls.item())
-            detected_classes.add(model.names[cls_id])
-
-    # Throttled MQTT Publishing
-    current_time = time.time()
-    if current_time - last_publish_time >= PUBLISH_INTERVAL:
-        msg = ",".join(detected_classes) if detected_classes else "NONE"
-        mqttc.publish(os.getenv("MQTT_TOPIC"), msg)
-        last_publish_time = current_time
-
-    # Display Annotated Frame
-    cv2.imshow('ESP32-CAM Feed', results[0].plot())
-    if cv2.waitKey(1) == ord('q'):
-        break
+        stages["total"] = time.perf_counter() - loop_start
+        metrics.observe("total", stages["total"])
+        metrics.increment("frames_total")
+        metrics.trace(stages, inferred=infer)
+except KeyboardInterrupt:
+    pass
 
 cam.release()
-cv2.destroyAllWindows()
+if restream is not None:
+    restream.close()
+metrics.close()
+if not HEADLESS:
+    cv2.destroyAllWindows()
+print("Capture stats:", cam.stats())
+print("Scene gate stats:", gate.stats())
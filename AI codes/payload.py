@@ -0,0 +1,114 @@
+import json
+import time
+
+# Detection message format shared by the detectors and the kiosk firmware
+# (IoT Codes/esp32.py). Compact JSON, all times in epoch milliseconds:
+#   {"v": 1, "seq": 812, "classes": ["bento"], "counts": [1], "conf": [0.91],
+#    "t_cap": ..., "t_inf": ..., "t_pub": ..., "session": "..."}
+# classes are ordered by confidence; session only appears in replies to
+# detect requests. Version 0 is the old bare "bento,rice-bowl" / "NONE".
+PAYLOAD_VERSION = 1
+
+
+def ms(seconds):
+    return int(seconds * 1000) if seconds else 0
+
+
+class FrameDetections:
+    # What one inferred frame contributes to a detection message
+
+    def __init__(self, seq=0, captured=0.0, inferred=0.0):
+        self.seq = seq
+        self.captured = captured  # Epoch seconds the frame was grabbed
+        self.inferred = inferred  # Epoch seconds inference finished
+        self.counts = {}  # Class name -> number of boxes
+        self.conf = {}  # Class name -> highest confidence
+
+    def add(self, name, conf):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.conf[name] = max(self.conf.get(name, 0.0), conf)
+
+    @property
+    def classes(self):
+        return set(self.counts)
+
+
+def encode(classes, detections=None, session=None, now=None):
+    # classes: the class set being reported (e.g. the publisher's stable set);
+    # counts, confidences and timestamps come from the latest frame
+    detections = detections or FrameDetections()
+    classes = sorted(classes, key=lambda name: -detections.conf.get(name, 0.0))
+    message = {
+        "v": PAYLOAD_VERSION,
+        "seq": detections.seq,
+        "classes": classes,
+        "counts": [detections.counts.get(name, 0) for name in classes],
+        "conf": [round(detections.conf.get(name, 0.0), 3) for name in classes],
+        "t_cap": ms(detections.captured),
+        "t_inf": ms(detections.inferred),
+        "t_pub": ms(time.time() if now is None else now),
+    }
+    if session is not None:
+        message["session"] = session
+    return json.dumps(message, separators=(",", ":"))
+
+
+def encode_text(classes):
+    # Version 0, still understood by the Arduino kiosk (IoT Codes/esp32.ino)
+    return ",".join(sorted(classes)) if classes else "NONE"
+
+
+def encode_as(kind, classes, detections=None):
+    # kind is the MQTT_PAYLOAD setting: "text" (version 0, the default so the
+    # Arduino kiosk keeps working) or "json" (version 1)
+    if kind == "json":
+        return encode(classes, detections)
+    return encode_text(classes)
+
+
+def decode(payload):
+    # Either version as a dict; version 0 only carries classes
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    if payload.startswith("{"):
+        return json.loads(payload)
+    classes = [] if payload == "NONE" else [name for name in payload.split(",") if name]
+    return {"v": 0, "classes": classes}
+
+
+class LatencyTracker:
+    # Collects the latency reports kiosks publish after acting on a message:
+    # {"kiosk": id, "seq": n, "t_cap": ..., "t_pub": ..., "t_rx": ...}. Each
+    # report is recorded as Metrics stages. kiosk_e2e (capture to kiosk) and
+    # kiosk_delivery (publish to kiosk) need NTP-synced clocks; kiosk_round_trip
+    # (publish to report received back here) uses only this machine's clock.
+
+    def __init__(self, client, topic, metrics):
+        self.topic = topic
+        self.metrics = metrics
+        self.reports = 0
+
+        client.message_callback_add(topic, self._on_report)
+        client.subscribe(topic)
+        # Subscriptions are lost on reconnect with a clean session
+        previous_on_connect = client.on_connect
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            client.subscribe(topic)
+            if previous_on_connect is not None:
+                previous_on_connect(client, userdata, flags, reason_code, properties)
+
+        client.on_connect = on_connect
+
+    def _on_report(self, client, userdata, msg):
+        now = ms(time.time())
+        try:
+            report = json.loads(msg.payload)
+            t_cap, t_pub, t_rx = int(report["t_cap"]), int(report["t_pub"]), int(report["t_rx"])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.reports += 1
+        self.metrics.observe("kiosk_round_trip", (now - t_pub) / 1000)
+        if t_rx and t_cap:
+            self.metrics.observe("kiosk_e2e", max(t_rx - t_cap, 0) / 1000)
+            self.metrics.observe("kiosk_delivery", max(t_rx - t_pub, 0) / 1000)
@@ -0,0 +1,63 @@
+import time
+from collections import Counter, deque
+
+from payload import encode_as
+
+
+class DetectionPublisher:
+    # Publishes the detected class set when it changes instead of on a fixed
+    # timer. A class counts as present once it was seen in at least
+    # min_votes of the last window frames, which filters single-frame
+    # flicker. While the stable set is unchanged only a heartbeat is sent.
+    # Messages are the old comma-joined string unless payload="json" asks
+    # for the versioned JSON payload (payload.py).
+
+    def __init__(self, client, topic, window=5, min_votes=3, heartbeat=30, qos=0, retain=False, payload="text"):
+        self.client = client
+        self.topic = topic
+        self.min_votes = min_votes
+        self.heartbeat = heartbeat
+        self.qos = qos
+        self.retain = retain
+        self.payload = payload
+
+        self.history = deque(maxlen=window)
+        self.stable = None  # Last published class set
+        self.last_publish = 0.0
+        self.published = 0
+
+    @classmethod
+    def from_env(cls, client, topic, env):
+        # Settings shared by every entry point, read from the .env file
+        return cls(
+            client,
+            topic,
+            window=int(env.get("PUBLISH_WINDOW", 5)),
+            min_votes=int(env.get("PUBLISH_MIN_VOTES", 3)),
+            heartbeat=float(env.get("PUBLISH_HEARTBEAT", 30)),
+            qos=int(env.get("MQTT_QOS", 0)),
+            retain=env.get("MQTT_RETAIN", "0") == "1",
+            payload=env.get("MQTT_PAYLOAD", "text"),
+        )
+
+    def vote(self, detected_classes):
+        self.history.append(frozenset(detected_classes))
+        votes = Counter(name for classes in self.history for name in classes)
+        return frozenset(name for name, count in votes.items() if count >= self.min_votes)
+
+    def update(self, detected_classes, now=None, detections=None):
+        # Feed one frame's classes (and optionally its FrameDetections for
+        # counts, confidences and timestamps); returns the message if published
+        now = time.time() if now is None else now
+        stable = self.vote(detected_classes)
+
+        changed = stable != self.stable
+        if not changed and now - self.last_publish < self.heartbeat:
+            return None
+
+        msg = encode_as(self.payload, stable, detections)
+        self.client.publish(self.topic, msg, qos=self.qos, retain=self.retain)
+        self.stable = stable
+        self.last_publish = now
+        self.published += 1
+        return msg
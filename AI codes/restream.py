@@ -0,0 +1,96 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from mjpeg import STREAM_CONTENT_TYPE, encode_part
+
+
+class MJPEGRestream:
+    # Serves annotated frames over HTTP as MJPEG. The detector only needs to
+    # draw and hand over a frame while somebody is watching, and at most
+    # max_fps times per second; JPEG encoding happens once per frame on the
+    # serving threads, not in the detection loop.
+
+    def __init__(self, port, max_fps=5, quality=80):
+        self.max_fps = max_fps
+        self.quality = quality
+        self.clients = 0
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._encode_lock = threading.Lock()
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._last_update = 0.0
+
+        restream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                restream._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mjpeg-restream", daemon=True)
+        self._thread.start()
+
+    def wants_frame(self):
+        # True when a client is connected and the rate cap allows a new frame
+        return self.clients > 0 and time.time() - self._last_update >= 1 / self.max_fps
+
+    def update(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._last_update = time.time()
+            self._cond.notify_all()
+
+    def _encoded(self, seq, frame):
+        # JPEG for the given frame, encoded by whichever client asks first
+        with self._encode_lock:
+            if self._jpeg_seq != seq:
+                ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not ok:
+                    return None
+                self._jpeg = buf.tobytes()
+                self._jpeg_seq = seq
+            return self._jpeg
+
+    def _serve(self, handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", STREAM_CONTENT_TYPE)
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        with self._cond:
+            self.clients += 1
+        sent_seq = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq != sent_seq, timeout=5)
+                    if self._seq == sent_seq:
+                        continue
+                    sent_seq = self._seq
+                    frame = self._frame
+                jpeg = self._encoded(sent_seq, frame)
+                if jpeg is None:
+                    continue
+                handler.wfile.write(encode_part(jpeg))
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
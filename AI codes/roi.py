@@ -0,0 +1,94 @@
+import argparse
+import os
+
+import numpy as np
+
+from evaluation import label_path, list_images, load_labels, split_dir
+
+
+class Roi:
+    # Tray region of a camera in normalised x1,y1,x2,y2 coordinates, so the
+    # same setting works for every frame size and decode scale. Inference
+    # runs on the crop (ultralytics letterboxes it) and boxes are shifted
+    # back to full-frame coordinates afterwards.
+
+    def __init__(self, x1, y1, x2, y2):
+        if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+            raise ValueError(f"invalid ROI {x1},{y1},{x2},{y2}")
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+
+    @classmethod
+    def parse(cls, text):
+        # "x1,y1,x2,y2" as in the ROI setting; None for an empty string
+        if not text or not text.strip():
+            return None
+        return cls(*(float(v) for v in text.split(",")))
+
+    def __str__(self):
+        return f"{self.x1:.3f},{self.y1:.3f},{self.x2:.3f},{self.y2:.3f}"
+
+    def pixels(self, shape):
+        height, width = shape[:2]
+        return (int(self.x1 * width), int(self.y1 * height),
+                max(int(round(self.x2 * width)), 1), max(int(round(self.y2 * height)), 1))
+
+    def crop(self, frame):
+        # A view of the region, no copy
+        x1, y1, x2, y2 = self.pixels(frame.shape)
+        return frame[y1:y2, x1:x2]
+
+    def map_back(self, result, shape):
+        # Shift a Results object computed on crop(frame) onto the full frame
+        x1, y1, _, _ = self.pixels(shape)
+        boxes = result.boxes.data.clone()
+        boxes[:, [0, 2]] += x1
+        boxes[:, [1, 3]] += y1
+        result.orig_shape = tuple(shape[:2])
+        result.update(boxes=boxes)
+        return result
+
+
+def parse_rois(text, count):
+    # One ROI per camera, separated by ";" (empty entries mean the full frame)
+    entries = text.split(";") if text else []
+    rois = [Roi.parse(entry) for entry in entries]
+    return rois + [None] * (count - len(rois))
+
+
+def calibrate(images, coverage=0.99, margin=0.05):
+    # Smallest region that contains the given share of all labelled box
+    # edges in the dataset, widened by margin on each side
+    boxes = [load_labels(label_path(path))[:, 1:] for path in images]
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32)
+    if not len(boxes):
+        return None
+    cx, cy, w, h = boxes.T
+    tail = (1 - coverage) * 100
+    x1 = np.percentile(cx - w / 2, tail) - margin
+    y1 = np.percentile(cy - h / 2, tail) - margin
+    x2 = np.percentile(cx + w / 2, 100 - tail) + margin
+    y2 = np.percentile(cy + h / 2, 100 - tail) + margin
+    return Roi(max(float(x1), 0.0), max(float(y1), 0.0), min(float(x2), 1.0), min(float(y2), 1.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Derive a tray ROI from the labelled dataset")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml"))
+    parser.add_argument("--splits", default="train,valid,test")
+    parser.add_argument("--coverage", type=float, default=0.99, help="share of box edges inside the ROI")
+    parser.add_argument("--margin", type=float, default=0.05, help="extra border, as a fraction of the frame")
+    args = parser.parse_args()
+
+    images = []
+    for split in args.splits.split(","):
+        images += list_images(split_dir(args.data, split))
+    roi = calibrate(images, args.coverage, args.margin)
+    if roi is None:
+        parser.error("no labels found")
+    area = (roi.x2 - roi.x1) * (roi.y2 - roi.y1)
+    print(f"{len(images)} images, ROI covers {area:.0%} of the frame")
+    print(f"ROI={roi}")
+
+
+if __name__ == "__main__":
+    main()
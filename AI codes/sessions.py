@@ -0,0 +1,152 @@
+import json
+import queue
+import threading
+import time
+
+from payload import encode
+
+
+class DetectionSession:
+    def __init__(self, kiosk, session, started):
+        self.kiosk = kiosk
+        self.session = session
+        self.started = started
+        self.last_classes = None
+        self.streak = 0  # Consecutive confident frames with the same classes
+
+
+class SessionManager:
+    # Request/response detection for kiosks. A kiosk publishes
+    # {"kiosk": id, "session": id} on the request topic; the detector runs
+    # until votes consecutive frames agree on a confident class set (or the
+    # session times out) and replies on <reply prefix>/<kiosk> with the same
+    # session id. Without an open session the detector can idle. Sources
+    # without a frame stream (a still image) hold() their detections instead
+    # and requests are answered from those straight away.
+
+    def __init__(self, client, request_topic, reply_prefix, votes=3, min_conf=0.7, timeout=10):
+        self.client = client
+        self.request_topic = request_topic
+        self.reply_prefix = reply_prefix.rstrip("/")
+        self.votes = votes
+        self.min_conf = min_conf
+        self.timeout = timeout
+
+        self.requests = queue.Queue()
+        self.sessions = {}  # kiosk id -> DetectionSession, newest request wins
+        self.held = None  # FrameDetections answering every request, see hold()
+        self._lock = threading.Lock()
+
+        client.message_callback_add(request_topic, self._on_request)
+        client.subscribe(request_topic)
+        # Subscriptions are lost on reconnect with a clean session
+        previous_on_connect = client.on_connect
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            client.subscribe(request_topic)
+            if previous_on_connect is not None:
+                previous_on_connect(client, userdata, flags, reason_code, properties)
+
+        client.on_connect = on_connect
+
+    @classmethod
+    def from_env(cls, client, env):
+        return cls(
+            client,
+            env.get("MQTT_REQUEST_TOPIC", "/predict/request"),
+            env.get("MQTT_REPLY_PREFIX", "/predict/classes"),
+            votes=int(env.get("SESSION_VOTES", 3)),
+            min_conf=float(env.get("SESSION_MIN_CONF", 0.7)),
+            timeout=float(env.get("SESSION_TIMEOUT", 10)),
+        )
+
+    def _on_request(self, client, userdata, msg):
+        try:
+            request = json.loads(msg.payload)
+            kiosk, session = str(request["kiosk"]), str(request["session"])
+        except (ValueError, KeyError, TypeError):
+            print("Ignoring malformed detect request:", msg.payload[:64])
+            return
+        request = DetectionSession(kiosk, session, time.time())
+        with self._lock:
+            held = self.held
+            if held is None:
+                self.requests.put(request)
+                return
+        self.reply(request, self.confident(held), held)
+
+    def _accept_requests(self):
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            self.sessions[request.kiosk] = request
+
+    def _expire(self, now):
+        # Sessions without a confident result get an empty reply
+        for kiosk, session in list(self.sessions.items()):
+            if now - session.started >= self.timeout:
+                self.reply(session, ())
+                del self.sessions[kiosk]
+
+    def confident(self, detections):
+        return frozenset(name for name, conf in detections.conf.items() if conf >= self.min_conf)
+
+    def hold(self, detections):
+        # Answer every request from these detections until hold(None);
+        # sessions already open are answered now
+        with self._lock:
+            self.held = detections
+            if detections is None:
+                return
+            self._accept_requests()
+            for session in self.sessions.values():
+                self.reply(session, self.confident(detections), detections)
+            self.sessions.clear()
+
+    def active(self):
+        with self._lock:
+            self._accept_requests()
+            self._expire(time.time())
+            return bool(self.sessions)
+
+    def wait(self, timeout=None):
+        # Block until a kiosk asks for a detection; True if one is open
+        try:
+            request = self.requests.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        with self._lock:
+            self.sessions[request.kiosk] = request
+        return True
+
+    def reply(self, session, classes, detections=None):
+        # Versioned payload (payload.py) with the session id; classes are
+        # empty when nothing confident was seen
+        message = encode(classes, detections, session=session.session)
+        self.client.publish(f"{self.reply_prefix}/{session.kiosk}", message, qos=1)
+
+    def update(self, detections, now=None, kiosks=None):
+        # Feed one frame's FrameDetections; frames captured before a request
+        # arrived are ignored for that request. kiosks limits the frame to
+        # the sessions of those kiosks (the ones this camera looks at).
+        now = time.time() if now is None else now
+        classes = self.confident(detections)
+
+        with self._lock:
+            self._accept_requests()
+            self._expire(now)
+            for kiosk, session in list(self.sessions.items()):
+                if detections.captured < session.started or (kiosks is not None and kiosk not in kiosks):
+                    continue
+
+                if classes and classes == session.last_classes:
+                    session.streak += 1
+                else:
+                    session.last_classes = classes
+                    session.streak = 1 if classes else 0
+
+                if session.streak >= self.votes:
+                    self.reply(session, classes, detections)
+                    del self.sessions[kiosk]
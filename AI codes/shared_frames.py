@@ -0,0 +1,272 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from capture import FrameGrabber
+
+# Largest frame a slot holds: UXGA BGR, the ESP32-CAM's biggest frame size
+MAX_FRAME_BYTES = 1600 * 1200 * 3
+
+# Control block fields
+LATEST, READER, CONSUMED, PAUSED, CAPTURED, DROPPED, RECONNECTS = range(7)
+CONTROL_SIZE = 8
+# Per-slot metadata fields
+SEQ, CAPTURED_NS, HEIGHT, WIDTH, DECODE_NS = range(5)
+META_SIZE = 5
+
+
+class FrameRing:
+    # A few frame slots in one shared memory block. The capture process
+    # decodes into a free slot and publishes it as the newest; the reader
+    # gets a numpy view of that slot, which stays reserved (never written)
+    # until the reader's next read. Nothing is pickled or sent through a pipe
+    # between processes; the reader never copies a frame. On the writer side
+    # a frame costs one memcpy into the slot unless the decoder wrote it
+    # there itself. All bookkeeping happens under one multiprocessing Condition.
+
+    def __init__(self, slots=3, slot_bytes=MAX_FRAME_BYTES, name=None, cond=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        header = (CONTROL_SIZE + slots * META_SIZE) * 8
+        header += -header % 64  # Keep frame data cache-line aligned
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=header + slots * slot_bytes)
+        self.cond = cond if cond is not None else multiprocessing.get_context("fork").Condition()
+
+        self.control = np.ndarray(CONTROL_SIZE, np.int64, self.shm.buf)
+        self.meta = np.ndarray((slots, META_SIZE), np.int64, self.shm.buf, offset=CONTROL_SIZE * 8)
+        self.data = np.ndarray((slots, slot_bytes), np.uint8, self.shm.buf, offset=header)
+        if self.owner:
+            self.control[:] = 0
+            self.control[LATEST] = self.control[READER] = -1
+            self.meta[:] = 0
+
+    def view(self, slot, shape):
+        return self.data[slot, :int(np.prod(shape))].reshape(shape)
+
+    def latest_seq(self):
+        with self.cond:
+            latest = self.control[LATEST]
+            return int(self.meta[latest, SEQ]) if latest >= 0 else 0
+
+    # Writer side (capture process)
+
+    def acquire(self):
+        # A slot that is neither the newest frame nor held by the reader
+        with self.cond:
+            busy = (self.control[LATEST], self.control[READER])
+        return next(slot for slot in range(self.slots) if slot not in busy)
+
+    def commit(self, slot, frame, decode, reconnects):
+        if frame.nbytes > self.slot_bytes:
+            print(f"Frame of {frame.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+            return False
+        target = self.view(slot, frame.shape)
+        if frame.ctypes.data != target.ctypes.data:
+            # The decoder allocated its own buffer: always with MJPEGClient and
+            # snapshots (cv2.imdecode has no output argument), and for the
+            # first frame or a size change with cv2.VideoCapture
+            np.copyto(target, frame)
+
+        with self.cond:
+            if self.control[PAUSED]:
+                return False
+            latest = self.control[LATEST]
+            seq = 1
+            if latest >= 0:
+                seq = self.meta[latest, SEQ] + 1
+                if self.meta[latest, SEQ] > self.control[CONSUMED]:
+                    # Previous frame was never picked up by the reader
+                    self.control[DROPPED] += 1
+            self.meta[slot] = (seq, time.time_ns(), frame.shape[0], frame.shape[1], int(decode * 1e9))
+            self.control[LATEST] = slot
+            self.control[CAPTURED] += 1
+            self.control[RECONNECTS] = reconnects
+            self.cond.notify_all()
+        return True
+
+    # Reader side (inference process)
+
+    def read(self, after_seq, timeout=None):
+        # (seq, capture time, decode seconds, frame view) of a frame newer than after_seq
+        with self.cond:
+            ready = self.cond.wait_for(
+                lambda: self.control[LATEST] >= 0 and self.meta[self.control[LATEST], SEQ] > after_seq,
+                timeout,
+            )
+            if not ready:
+                return None
+            slot = int(self.control[LATEST])
+            self.control[READER] = slot
+            seq, captured_ns, height, width, decode_ns = (int(v) for v in self.meta[slot])
+            self.control[CONSUMED] = seq
+            self.cond.notify_all()
+        return seq, captured_ns / 1e9, decode_ns / 1e9, self.view(slot, (height, width, 3))
+
+    def close(self):
+        # Views must be dropped before the block can be closed
+        del self.control, self.meta, self.data
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A caller still holds a frame view; the mapping goes away at exit
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingGrabber(FrameGrabber):
+    # FrameGrabber running in the capture process: same reconnect and
+    # pause handling, but frames end up in ring slots. cv2.VideoCapture
+    # (OPENCV_CAPTURE=1) decodes straight into the slot; MJPEGClient and
+    # snapshot JPEGs are decoded by imdecode and copied in by commit().
+
+    def __init__(self, url, ring, reconnect_delay=2, decode_size=None):
+        self.ring = ring
+        self._slot = None
+        self._shape = None
+        super().__init__(url, reconnect_delay, decode_size=decode_size)
+
+    def _read(self):
+        self._slot = self.ring.acquire()
+        if self._shape is None or not isinstance(self.cam, cv2.VideoCapture):
+            # imdecode can't write in place; commit() copies those frames into the slot
+            return self.cam.read()
+        return self.cam.read(self.ring.view(self._slot, self._shape))
+
+    def _store(self, frame, decode):
+        if self._paused:
+            return False
+        self._shape = frame.shape
+        if not self.ring.commit(self._slot, frame, decode, self.reconnects):
+            return False
+        self.frames_captured += 1
+        return True
+
+    def _wait_consumed(self):
+        # The consumer lives in the other process; wait on the ring instead
+        while self._running:
+            with self.ring.cond:
+                consumed = self.ring.cond.wait_for(
+                    lambda: self.ring.control[LATEST] < 0
+                    or self.ring.meta[self.ring.control[LATEST], SEQ] <= self.ring.control[CONSUMED],
+                    timeout=0.5,
+                )
+            if consumed:
+                return
+
+
+def capture_main(url, name, slots, slot_bytes, cond, conn, reconnect_delay, decode_size):
+    ring = FrameRing(slots, slot_bytes, name=name, cond=cond)
+    grabber = RingGrabber(url, ring, reconnect_delay, decode_size)
+    conn.send(grabber.isOpened())
+    try:
+        while True:
+            command = conn.recv()
+            if command == "start":
+                grabber.start()
+            elif command == "pause":
+                grabber.pause()
+            elif command == "resume":
+                grabber.resume()
+            else:
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        grabber.release()
+        ring.close()
+
+
+class CaptureProcess:
+    # Drop-in replacement for FrameGrabber that captures and decodes in a
+    # separate process, so JPEG decoding doesn't compete with inference for
+    # the GIL. read() returns a view into shared memory that stays valid
+    # until the next read().
+
+    def __init__(self, url, slots=3, slot_bytes=MAX_FRAME_BYTES, reconnect_delay=2, metrics=None, open_timeout=30,
+                 decode_size=None):
+        self.url = url
+        self.metrics = metrics  # Optional Metrics, receives the "decode" stage
+        self.ring = FrameRing(slots, slot_bytes)
+        self.read_timestamp = 0.0  # Capture time of the frame last returned by read()
+        self.read_seq = 0  # Its sequence number
+        self._last_seq = 0
+        self._final_stats = None
+
+        # fork: a spawned child would re-run the importing script; create this
+        # before starting MQTT or loading the model
+        context = multiprocessing.get_context("fork")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=capture_main,
+            args=(url, self.ring.shm.name, slots, slot_bytes, self.ring.cond, child_conn, reconnect_delay, decode_size),
+            name="frame-capture",
+            daemon=True,
+        )
+        self._process.start()
+        self._opened = self._conn.poll(open_timeout) and self._conn.recv()
+
+    def _send(self, command):
+        try:
+            self._conn.send(command)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def isOpened(self):
+        return self._opened
+
+    def start(self):
+        self._send("start")
+        return self
+
+    def pause(self):
+        # Close the stream until resume(); frames from before the pause are never returned
+        with self.ring.cond:
+            self.ring.control[PAUSED] = 1
+            self._last_seq = self.ring.latest_seq()
+            self.ring.control[CONSUMED] = self._last_seq
+            self.ring.cond.notify_all()
+        self._send("pause")
+
+    def resume(self):
+        with self.ring.cond:
+            self.ring.control[PAUSED] = 0
+        self._send("resume")
+
+    def read(self, timeout=None):
+        # Block until a frame newer than the last one returned is available
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            frame = self.ring.read(self._last_seq, max(wait, 0))
+            if frame is not None:
+                break
+            if not self._process.is_alive() or (deadline is not None and time.monotonic() >= deadline):
+                return False, None
+
+        self._last_seq, self.read_timestamp, decode, view = frame
+        self.read_seq = self._last_seq
+        if self.metrics is not None:
+            self.metrics.observe("decode", decode)
+        return True, view
+
+    def stats(self):
+        if self._final_stats is not None:
+            return self._final_stats
+        with self.ring.cond:
+            return {
+                "captured": int(self.ring.control[CAPTURED]),
+                "dropped": int(self.ring.control[DROPPED]),
+                "reconnects": int(self.ring.control[RECONNECTS]),
+            }
+
+    def release(self):
+        self._final_stats = self.stats()
+        self._send("stop")
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.ring.close()
@@ -1,8 +1,12 @@
 from machine import Pin, SPI, I2C
 import time
 import network
+import uasyncio as asyncio
 from umqtt.simple import MQTTClient
 import ubinascii
+import ujson
+import os
+import ntptime
 import mfrc522
 from esp32_cam import Camera  # You'll need to implement this separately
 from lcd_i2c import LCD  # You'll need an I2C LCD library for MicroPython
@@ -28,6 +32,14 @@ WIFI_PASS = "YOUR_WIFI_PASSWORD"
 MQTT_BROKER = "broker.emqx.io"
 MQTT_TOPIC = b"/predict/classes"
 CLIENT_ID = ubinascii.hexlify(machine.unique_id())
+# Detection requests go to the detector, results come back on our own topic.
+# Broadcasts on MQTT_TOPIC are a fallback for detectors that don't answer.
+REQUEST_TOPIC = b"/predict/request"
+REPLY_TOPIC = MQTT_TOPIC + b"/" + CLIENT_ID
+FOODS = ("bento", "rice-bowl")
+# Receive times go back to the detector for end-to-end latency tracking
+LATENCY_TOPIC = b"/predict/latency"
+MAX_RESULT_AGE_MS = 3000  # Results from frames older than this are dropped
 
 # System state
 class SystemState:
@@ -44,6 +56,9 @@ current_state = SystemState.WELCOME
 last_state_change = time.ticks_ms()
 detected_food = "Bento"  # Default value
 camera_active = False
+session_id = None  # Detect request we are waiting for
+request_ms = 0  # When it was sent, epoch milliseconds
+clock_synced = False  # Result ages are only meaningful with NTP time
 
 # Initialize camera (you'll need to implement this)
 camera = Camera()
@@ -59,172 +74,397 @@ def connect_wifi():
             pass
     print('Network config:', sta_if.ifconfig())
 
+# Wall clock in epoch milliseconds, the unit of the payload timestamps
+# (some MicroPython ports count from 2000 instead of 1970)
+EPOCH_OFFSET_MS = 946684800000 if time.gmtime(0)[0] == 2000 else 0
+
+def now_ms():
+    return time.time_ns() // 1000000 + EPOCH_OFFSET_MS
+
+def sync_clock():
+    global clock_synced
+    try:
+        ntptime.settime()
+        clock_synced = True
+    except Exception as e:
+        print("NTP sync failed:", e)
+
+def report_latency(reply, received):
+    # Lets the detector measure capture -> kiosk and publish -> kiosk times
+    report = ujson.dumps({
+        "kiosk": CLIENT_ID.decode(),
+        "seq": reply.get("seq", 0),
+        "t_cap": reply.get("t_cap", 0),
+        "t_pub": reply.get("t_pub", 0),
+        "t_rx": received if clock_synced else 0,
+    })
+    try:
+        mqtt_client.publish(LATENCY_TOPIC, report)
+    except Exception as e:
+        print("Latency report failed:", e)
+
+def parse_result(msg):
+    # Versioned JSON, or the old bare "bento,rice-bowl" / "NONE" string
+    try:
+        return ujson.loads(msg)
+    except ValueError:
+        text = msg.decode()
+        return {"v": 0, "classes": [] if text == "NONE" else text.split(",")}
+
 # MQTT callback
 def mqtt_callback(topic, msg):
     global detected_food
-    message = msg.decode()
+    received = now_ms()
+    if current_state != SystemState.PROCESSING:
+        return
+    reply = parse_result(msg)
+    if topic == REPLY_TOPIC:
+        # Only accept the reply to our current request; stale results are dropped
+        if reply.get("session") != session_id:
+            return
+    else:
+        # Broadcast: only a positive result, from a frame taken after the request
+        if not any(name in FOODS for name in reply.get("classes", [])):
+            return
+        if clock_synced and reply.get("t_cap", request_ms) < request_ms:
+            return
+    if reply.get("v", 0) >= 1:
+        report_latency(reply, received)
+        age = received - reply.get("t_cap", 0)
+        print("Result seq", reply.get("seq"), "age", age, "ms")
+        if clock_synced and reply.get("t_cap") and age > MAX_RESULT_AGE_MS:
+            # The tray may have changed since that frame, ask again
+            post(Event.NOT_DETECTED)
+            return
     
-    if message in ["bento", "rice-bowl"]:
-        detected_food = message.upper()
-        print("Detected food:", detected_food)
+    # Classes arrive ordered by confidence
+    for name in reply.get("classes", []):
+        if name in FOODS:
+            detected_food = name.upper()
+            print("Detected food:", detected_food)
+            post(Event.DETECTED)
+            return
+    post(Event.NOT_DETECTED)
+
+def request_detection():
+    # Open a new session; the detector replies on REPLY_TOPIC with the same id
+    global session_id, request_ms
+    session_id = ubinascii.hexlify(os.urandom(4)).decode()
+    request_ms = now_ms()
+    request = ujson.dumps({"kiosk": CLIENT_ID.decode(), "session": session_id})
+    try:
+        mqtt_client.publish(REQUEST_TOPIC, request)
+    except Exception as e:
+        print("Detect request failed:", e)
 
 # Connect to MQTT
 def connect_mqtt():
     client = MQTTClient(CLIENT_ID, MQTT_BROKER)
     client.set_callback(mqtt_callback)
     client.connect()
+    client.subscribe(REPLY_TOPIC)
     client.subscribe(MQTT_TOPIC)
     print("Connected to MQTT broker")
     return client
 
+sync_clock()
 try:
     mqtt_client = connect_mqtt()
 except Exception as e:
+    mqtt_client = None
     print("MQTT connection failed:", e)
 
-# State display functions
+# Differential LCD rendering
+class LcdRenderer:
+    # Keeps a shadow copy of the 20x4 display. A screen is only rebuilt when
+    # its key (state plus the data it shows) changes, and then only the
+    # characters that differ from what is already displayed go over I2C.
+    def __init__(self, lcd, cols=20, rows=4):
+        self.lcd = lcd
+        self.cols = cols
+        self.rows = rows
+        self.shown = [" " * cols for _ in range(rows)]
+        self.key = None
+        lcd.clear()
+
+    def render(self, key, screen):
+        if key == self.key:
+            return
+        self.key = key
+        lines = screen()
+        for row in range(self.rows):
+            text = lines[row] if row < len(lines) else ""
+            text = (text + " " * self.cols)[:self.cols]
+            self.write_changes(row, text)
+
+    def write_changes(self, row, text):
+        old = self.shown[row]
+        col = 0
+        while col < self.cols:
+            if text[col] == old[col]:
+                col += 1
+                continue
+            # Extend the run over short unchanged gaps; a cursor move costs
+            # more than re-sending one or two characters
+            end = col + 1
+            while end < self.cols:
+                if text[end] != old[end]:
+                    end += 1
+                    continue
+                gap = end
+                while gap < self.cols and gap - end < 2 and text[gap] == old[gap]:
+                    gap += 1
+                if gap < self.cols and text[gap] != old[gap]:
+                    end = gap
+                else:
+                    break
+            self.lcd.set_cursor(col, row)
+            self.lcd.putstr(text[col:end])
+            col = end
+        self.shown[row] = text
+
+renderer = LcdRenderer(lcd)
+
+# State screens, one string per LCD row
 def display_welcome():
-    lcd.clear()
-    lcd.putstr("SELAMAT DATANG DI")
-    lcd.set_cursor(0, 1)
-    lcd.putstr("    TAP N GO    ")
-    lcd.set_cursor(0, 3)
-    lcd.putstr("    Klik OK     ")
+    return [
+        "SELAMAT DATANG DI",
+        "    TAP N GO    ",
+        "",
+        "    Klik OK     ",
+    ]
 
 def display_scan_card():
-    lcd.clear()
-    lcd.set_cursor(0, 1)
-    lcd.putstr(" SILAHKAN TEMPEL ")
-    lcd.set_cursor(0, 2)
-    lcd.putstr("   KARTU ANDA   ")
+    return [
+        "",
+        " SILAHKAN TEMPEL ",
+        "   KARTU ANDA   ",
+    ]
 
 def display_main_menu():
-    lcd.clear()
-    lcd.set_cursor(0, 0)
-    lcd.putstr(" SILAHKAN TARUH ")
-    lcd.set_cursor(0, 1)
-    lcd.putstr("MAKANAN/MINUMAN")
-    lcd.set_cursor(0, 2)
-    lcd.putstr("  ANDA LALU   ")
-    lcd.set_cursor(0, 3)
-    lcd.putstr(" TEKAN CONFIRM ")
+    return [
+        " SILAHKAN TARUH ",
+        "MAKANAN/MINUMAN",
+        "  ANDA LALU   ",
+        " TEKAN CONFIRM ",
+    ]
 
 def display_processing():
-    lcd.clear()
-    lcd.set_cursor(0, 1)
-    lcd.putstr("     SEDANG     ")
-    lcd.set_cursor(0, 2)
-    lcd.putstr(" MEMPROSES...  ")
+    return [
+        "",
+        "     SEDANG     ",
+        " MEMPROSES...  ",
+    ]
 
 def display_payment_confirmation():
-    lcd.clear()
-    lcd.set_cursor(0, 0)
-    lcd.putstr("ITEM: " + detected_food)
-    lcd.set_cursor(0, 1)
-    lcd.putstr("QTY: 1x")
-    
     # Calculate price based on food type
     price = 10000 if detected_food == "BENTO" else 15000
-    lcd.set_cursor(0, 2)
-    lcd.putstr("Harga: Rp{}".format(price))
-    
-    lcd.set_cursor(0, 3)
-    lcd.putstr(" [OK]   [Cancel] ")
+    return [
+        "ITEM: " + detected_food,
+        "QTY: 1x",
+        "Harga: Rp{}".format(price),
+        " [OK]   [Cancel] ",
+    ]
 
 def display_payment_processing():
-    lcd.clear()
-    lcd.set_cursor(0, 1)
-    lcd.putstr(" TEMPELKAN KARTU ")
-    lcd.set_cursor(0, 2)
-    lcd.putstr("UNTUK PEMBAYARAN")
+    return [
+        "",
+        " TEMPELKAN KARTU ",
+        "UNTUK PEMBAYARAN",
+    ]
 
 def display_payment_success():
-    lcd.clear()
-    lcd.set_cursor(0, 1)
-    lcd.putstr("  PEMBAYARAN   ")
-    lcd.set_cursor(0, 2)
-    lcd.putstr("    SUKSES!    ")
-    lcd.set_cursor(0, 3)
-    lcd.putstr("  TERIMA KASIH ")
+    return [
+        "",
+        "  PEMBAYARAN   ",
+        "    SUKSES!    ",
+        "  TERIMA KASIH ",
+    ]
 
 def display_payment_cancelled():
-    lcd.clear()
-    lcd.set_cursor(0, 1)
-    lcd.putstr("  PEMBELIAN   ")
-    lcd.set_cursor(0, 2)
-    lcd.putstr(" DIBATALKAN  ")
-    lcd.set_cursor(0, 3)
-    lcd.putstr(" TERIMA KASIH ")
+    return [
+        "",
+        "  PEMBELIAN   ",
+        " DIBATALKAN  ",
+        " TERIMA KASIH ",
+    ]
+
+SCREENS = {
+    SystemState.WELCOME: display_welcome,
+    SystemState.SCAN_CARD: display_scan_card,
+    SystemState.MAIN_MENU: display_main_menu,
+    SystemState.PROCESSING: display_processing,
+    SystemState.PAYMENT_CONFIRMATION: display_payment_confirmation,
+    SystemState.PAYMENT_PROCESSING: display_payment_processing,
+    SystemState.PAYMENT_SUCCESS: display_payment_success,
+    SystemState.PAYMENT_CANCELLED: display_payment_cancelled,
+}
+
+def update_display():
+    # Only the confirmation screen shows data besides the state
+    data = detected_food if current_state == SystemState.PAYMENT_CONFIRMATION else None
+    renderer.render((current_state, data), SCREENS[current_state])
+
+# Events posted by the buttons, the RFID poller, MQTT and state timers
+class Event:
+    GREEN = 0
+    RED = 1
+    YELLOW = 2
+    CARD = 3
+    DETECTED = 4
+    NOT_DETECTED = 5
+    TIMEOUT = 6
+
+events = []
+wake = asyncio.ThreadSafeFlag()  # Set from IRQs and tasks, wakes the state machine
+MAX_EVENTS = 16
+
+def post(event):
+    if len(events) < MAX_EVENTS:
+        events.append(event)
+    wake.set()
+
+# Debounced push buttons (active low)
+DEBOUNCE_MS = 50
+
+class Button:
+    def __init__(self, pin, event):
+        self.pin = pin
+        self.event = event
+        self.last_press = time.ticks_ms()
+        pin.irq(trigger=Pin.IRQ_FALLING, handler=self.on_edge)
+
+    def on_edge(self, pin):
+        # Ignore contact bounce and edges that aren't a real press
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.last_press) < DEBOUNCE_MS or pin.value() != 0:
+            return
+        self.last_press = now
+        post(self.event)
+
+buttons = [
+    Button(GREEN_BUTTON, Event.GREEN),
+    Button(RED_BUTTON, Event.RED),
+    Button(YELLOW_BUTTON, Event.YELLOW),
+]
+
+# State timeouts (ms)
+PROCESSING_TIMEOUT_MS = 12000  # Give up if the detector never answers
+RESULT_SCREEN_MS = 3000
+timer_task = None
+
+async def state_timer(ms, state):
+    await asyncio.sleep_ms(ms)
+    if current_state == state:
+        post(Event.TIMEOUT)
 
 def change_state(new_state):
-    global current_state, last_state_change
+    global current_state, last_state_change, timer_task
     current_state = new_state
     last_state_change = time.ticks_ms()
-    lcd.clear()
-
-# Main loop
-while True:
-    # Check for RFID card
-    (status, tag_type) = rfid.request(rfid.REQIDL)
-    card_present = status == rfid.OK
     
-    # Handle MQTT messages
-    try:
-        mqtt_client.check_msg()
-    except:
-        # Try to reconnect if connection lost
-        try:
-            mqtt_client = connect_mqtt()
-        except:
-            pass
+    # Arm the timeout of the new state, cancelling the previous one
+    if timer_task is not None:
+        timer_task.cancel()
+        timer_task = None
+    if new_state == SystemState.PROCESSING:
+        timer_task = asyncio.create_task(state_timer(PROCESSING_TIMEOUT_MS, new_state))
+    elif new_state in (SystemState.PAYMENT_SUCCESS, SystemState.PAYMENT_CANCELLED):
+        timer_task = asyncio.create_task(state_timer(RESULT_SCREEN_MS, new_state))
+
+def handle_event(event):
+    global camera_active
     
-    # State machine
     if current_state == SystemState.WELCOME:
-        display_welcome()
-        if GREEN_BUTTON.value() == 0:
+        if event == Event.GREEN:
             change_state(SystemState.SCAN_CARD)
     
     elif current_state == SystemState.SCAN_CARD:
-        display_scan_card()
-        if card_present:
+        if event == Event.CARD:
             change_state(SystemState.MAIN_MENU)
     
     elif current_state == SystemState.MAIN_MENU:
-        display_main_menu()
-        if YELLOW_BUTTON.value() == 0:
+        if event == Event.YELLOW:
             # Activate camera
             camera_active = True
             camera.start_streaming()
             change_state(SystemState.PROCESSING)
+            request_detection()
     
     elif current_state == SystemState.PROCESSING:
-        display_processing()
-        if detected_food != "Bento" and time.ticks_diff(time.ticks_ms(), last_state_change) > 2000:
+        if event in (Event.DETECTED, Event.NOT_DETECTED, Event.TIMEOUT):
             # Deactivate camera after detection
             camera_active = False
             camera.stop_streaming()
-            change_state(SystemState.PAYMENT_CONFIRMATION)
+            if event == Event.DETECTED:
+                change_state(SystemState.PAYMENT_CONFIRMATION)
+            else:
+                # Nothing recognised, let the customer place the item again
+                change_state(SystemState.MAIN_MENU)
     
     elif current_state == SystemState.PAYMENT_CONFIRMATION:
-        display_payment_confirmation()
-        if GREEN_BUTTON.value() == 0:
+        if event == Event.GREEN:
             change_state(SystemState.PAYMENT_PROCESSING)
-        elif RED_BUTTON.value() == 0:
+        elif event == Event.RED:
             change_state(SystemState.PAYMENT_CANCELLED)
     
     elif current_state == SystemState.PAYMENT_PROCESSING:
-        display_payment_processing()
-        if card_present:
+        if event == Event.CARD:
             change_state(SystemState.PAYMENT_SUCCESS)
     
-    elif current_state == SystemState.PAYMENT_SUCCESS:
-        display_payment_success()
-        if time.ticks_diff(time.ticks_ms(), last_state_change) > 3000:
+    elif current_state in (SystemState.PAYMENT_SUCCESS, SystemState.PAYMENT_CANCELLED):
+        if event == Event.TIMEOUT:
             change_state(SystemState.WELCOME)
-    
-    elif current_state == SystemState.PAYMENT_CANCELLED:
-        display_payment_cancelled()
-        if time.ticks_diff(time.ticks_ms(), last_state_change) > 3000:
-            change_state(SystemState.WELCOME)
-    
-    time.sleep_ms(100)
+
+# RFID poller, only active while a card is expected
+RFID_POLL_MS = 50
+RFID_IDLE_MS = 250
+
+async def rfid_task():
+    while True:
+        if current_state in (SystemState.SCAN_CARD, SystemState.PAYMENT_PROCESSING):
+            (status, tag_type) = rfid.request(rfid.REQIDL)
+            if status == rfid.OK:
+                post(Event.CARD)
+            await asyncio.sleep_ms(RFID_POLL_MS)
+        else:
+            await asyncio.sleep_ms(RFID_IDLE_MS)
+
+# MQTT task: poll for messages and reconnect when the connection drops
+MQTT_POLL_MS = 50
+MQTT_RETRY_MS = 5000
+
+async def mqtt_task():
+    global mqtt_client
+    while True:
+        if mqtt_client is None:
+            try:
+                mqtt_client = connect_mqtt()
+            except Exception as e:
+                print("MQTT connection failed:", e)
+                await asyncio.sleep_ms(MQTT_RETRY_MS)
+                continue
+        try:
+            mqtt_client.check_msg()
+        except Exception:
+            # Try to reconnect if connection lost
+            mqtt_client = None
+            continue
+        await asyncio.sleep_ms(MQTT_POLL_MS)
+
+async def state_machine():
+    update_display()
+    while True:
+        # Sleep until an IRQ or task posts something
+        await wake.wait()
+        while events:
+            handle_event(events.pop(0))
+            # Redraw only what changed
+            update_display()
+
+async def main():
+    asyncio.create_task(rfid_task())
+    asyncio.create_task(mqtt_task())
+    await state_machine()
+
+asyncio.run(main())
@@ -1,6 +1,6 @@
 import network
-import socket
 import time
+import uasyncio as asyncio
 from machine import Pin
 import camera
 import gc
@@ -67,66 +67,211 @@ html = """<html>
 </body>
 </html>"""
 
+# Frame sizes selectable per request, e.g. /stream?framesize=VGA&quality=12&fps=5
+# (fps is per client; framesize and quality are sensor-wide)
+FRAMESIZES = {
+    "QVGA": camera.FRAME_QVGA,  # 320x240
+    "VGA": camera.FRAME_VGA,    # 640x480
+    "SVGA": camera.FRAME_SVGA,  # 800x600
+    "XGA": camera.FRAME_XGA,    # 1024x768
+    "HD": camera.FRAME_HD,      # 1280x720
+    "SXGA": camera.FRAME_SXGA,  # 1280x1024
+    "UXGA": camera.FRAME_UXGA,  # 1600x1200
+}
+DEFAULT_FPS = 10
+
+# Current sensor settings (start with the boot configuration)
+sensor = {"framesize": "UXGA", "quality": 10}
+
 # Boundary for MJPEG stream
 BOUNDARY = "123456789000000000000987654321"
 STREAM_CONTENT_TYPE = "multipart/x-mixed-replace;boundary=" + BOUNDARY
 STREAM_BOUNDARY = "\r\n--" + BOUNDARY + "\r\n"
 STREAM_PART = "Content-Type: image/jpeg\r\nContent-Length: %s\r\n\r\n"
 
-def handle_client(conn):
-    request = conn.recv(1024)
-    request = str(request)
-    
-    # Handle root request
-    if "/stream" not in request:
-        conn.send("HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
-        conn.send(html)
-        conn.close()
+def parse_request(request):
+    # b"GET /stream?framesize=VGA HTTP/1.1..." -> ("/stream", {"framesize": "VGA"})
+    try:
+        target = request.split(b"\r\n", 1)[0].split(b" ")[1].decode()
+    except (IndexError, UnicodeError):
+        return "/", {}
+    path, _, query = target.partition("?")
+    params = {}
+    for pair in query.split("&"):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            params[key] = value
+    return path, params
+
+def configure_camera(params):
+    # Apply framesize/quality query parameters; only touch the sensor on change.
+    # There is one sensor, so the settings are global: while anyone is
+    # streaming, a request for different settings is refused (returns an
+    # error message) instead of silently changing the other viewers' frames.
+    framesize = params.get("framesize", "").upper()
+    if framesize not in FRAMESIZES:
+        framesize = sensor["framesize"]
+    try:
+        quality = int(params.get("quality", sensor["quality"]))
+    except ValueError:
+        quality = sensor["quality"]
+    quality = min(max(quality, 10), 63)  # 10 = best, 63 = smallest
+
+    if (framesize, quality) == (sensor["framesize"], sensor["quality"]):
+        return None
+    if clients:
+        return "Camera is streaming at framesize=%s&quality=%d" % (sensor["framesize"], sensor["quality"])
+
+    if framesize != sensor["framesize"]:
+        camera.framesize(FRAMESIZES[framesize])
+        sensor["framesize"] = framesize
+        camera.capture()  # Discard the frame buffered at the old size
+    if quality != sensor["quality"]:
+        camera.quality(quality)
+        sensor["quality"] = quality
+    return None
+
+async def send_conflict(writer, message):
+    writer.write(b"HTTP/1.1 409 Conflict\r\nContent-Type: text/plain\r\nConnection: close\r\n\r\n")
+    writer.write(message.encode())
+    await writer.drain()
+
+# Scheduled garbage collection instead of one collect per frame
+GC_EVERY = 30          # frames
+GC_MIN_FREE = 64 * 1024  # bytes, collect early when the heap gets tight
+
+class StreamClient:
+    # One connected /stream viewer. It holds at most one pending frame: if a
+    # new frame arrives before the previous one was sent, the old one is
+    # dropped, so a slow client only slows itself down.
+    def __init__(self, fps):
+        self.interval = int(1000 / fps) if fps > 0 else 0  # ms
+        self.last_frame = time.ticks_add(time.ticks_ms(), -self.interval)
+        self.frame = None
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def wants_frame(self, now):
+        return time.ticks_diff(now, self.last_frame) >= self.interval
+
+    def offer(self, frame, now):
+        if self.frame is not None:
+            self.dropped += 1
+        self.frame = frame
+        self.last_frame = now
+        self.ready.set()
+
+clients = []
+
+async def capture_loop():
+    # Capture each frame once and fan it out to every connected client
+    frames = 0
+    while True:
+        if not clients:
+            await asyncio.sleep_ms(50)
+            continue
+        
+        started = time.ticks_ms()
+        # Run as fast as the most demanding client asks for
+        interval = min(client.interval for client in clients)
+        waiting = [client for client in clients if client.wants_frame(started)]
+        if waiting:
+            frame = camera.capture()
+            if frame:
+                for client in waiting:
+                    client.offer(frame, started)
+            else:
+                print("Failed to capture frame")
+            frames += 1
+            if frames % GC_EVERY == 0:
+                gc.collect()
+        if gc.mem_free() < GC_MIN_FREE:
+            gc.collect()
+        
+        # Yield to the network tasks until the next frame is due
+        elapsed = time.ticks_diff(time.ticks_ms(), started)
+        await asyncio.sleep_ms(max(interval - elapsed, 1))
+
+async def send_capture(writer):
+    # Single JPEG, for clients that pull frames only when they need them
+    frame = camera.capture()
+    if not frame:
+        writer.write(b"HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\n\r\n")
+        await writer.drain()
         return
+    writer.write(b"HTTP/1.1 200 OK\r\n")
+    writer.write(b"Content-Type: image/jpeg\r\n")
+    writer.write(("Content-Length: %s\r\n" % len(frame)).encode())
+    writer.write(b"Connection: close\r\n")
+    writer.write(b"\r\n")
+    writer.write(frame)
+    await writer.drain()
+
+async def send_stream(writer, params):
+    try:
+        fps = float(params.get("fps", DEFAULT_FPS))
+    except ValueError:
+        fps = DEFAULT_FPS
     
     # Handle MJPEG stream request
-    conn.send("HTTP/1.1 200 OK\r\n")
-    conn.send("Content-Type: " + STREAM_CONTENT_TYPE + "\r\n")
-    conn.send("Connection: close\r\n")
-    conn.send("\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\n")
+    writer.write(("Content-Type: " + STREAM_CONTENT_TYPE + "\r\n").encode())
+    writer.write(b"Connection: close\r\n")
+    writer.write(b"\r\n")
+    await writer.drain()
     
+    client = StreamClient(fps)
+    clients.append(client)
     try:
         while True:
-            # Capture frame
-            frame = camera.capture()
-            if not frame:
-                print("Failed to capture frame")
-                break
+            await client.ready.wait()
+            client.ready.clear()
+            frame, client.frame = client.frame, None
+            if frame is None:
+                continue
             
             # Send frame
-            conn.send(STREAM_BOUNDARY)
-            conn.send(STREAM_PART % len(frame))
-            conn.send(frame)
-            
-            # Small delay to prevent high CPU usage
-            time.sleep(0.1)
-            
-            # Clean up
-            gc.collect()
-            
+            writer.write(STREAM_BOUNDARY.encode())
+            writer.write((STREAM_PART % len(frame)).encode())
+            writer.write(frame)
+            await writer.drain()
+    finally:
+        clients.remove(client)
+        print("Stream client left, %d frames dropped" % client.dropped)
+
+async def handle_client(reader, writer):
+    try:
+        request = await reader.read(1024)
+        path, params = parse_request(request)
+        
+        if path in ("/capture", "/stream"):
+            # Settings are shared by all clients, see configure_camera
+            error = configure_camera(params)
+            if error:
+                await send_conflict(writer, error)
+            elif path == "/capture":
+                await send_capture(writer)
+            else:
+                await send_stream(writer, params)
+        else:
+            # Handle root request
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
+            writer.write(html.encode())
+            await writer.drain()
     except Exception as e:
-        print("Stream error:", e)
+        print("Client error:", e)
     finally:
-        conn.close()
+        writer.close()
+        await writer.wait_closed()
 
-# Create server socket
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind(('0.0.0.0', 80))
-server_socket.listen(5)
-print("Camera streaming server started on", wlan.ifconfig()[0])
+async def main():
+    await asyncio.start_server(handle_client, "0.0.0.0", 80, backlog=5)
+    print("Camera streaming server started on", wlan.ifconfig()[0])
+    await capture_loop()
 
-# Main loop to handle clients
+# Serve clients and capture frames cooperatively
 try:
-    while True:
-        conn, addr = server_socket.accept()
-        print("Client connected from", addr)
-        handle_client(conn)
+    asyncio.run(main())
 except Exception as e:
     print("Server error:", e)
-    server_socket.close()
     led.value(0)
@@ -2,14 +2,28 @@ import streamlit as st
 import cv2
 import numpy as np
 from PIL import Image
-from ultralytics import YOLO
-import tempfile
 import paho.mqtt.client as mqtt
 import os
 from dotenv import load_dotenv
+import sys
 import time
+import uuid
+import hashlib
+import threading
+from collections import deque
 from streamlit_webrtc import webrtc_streamer
 import av
+from concurrent.futures import CancelledError
+from inference import InferenceServer
+from video import VideoJob
+
+# Detector modules shared with the MQTT detector in "AI codes"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI codes"))
+from publisher import DetectionPublisher
+from sessions import SessionManager
+from payload import FrameDetections, encode_as
+from metrics import Metrics
+from backends import model_path_from_env
 
 # Load environment variables
 load_dotenv()
@@ -26,10 +40,55 @@ if 'mqttc' not in st.session_state:
             int(os.getenv("MQTT_PORT"))
         )
         st.session_state.mqttc.loop_start()
+        # Answer kiosk detect requests from whichever input is active
+        st.session_state.sessions = SessionManager.from_env(st.session_state.mqttc, os.environ)
     except Exception as e:
         st.error(f"MQTT Connection Error: {str(e)}")
 
-model = YOLO('tap-n-go-detection.pt')
+# Plain references for processors running outside the script thread
+mqttc = st.session_state.get('mqttc')
+sessions = st.session_state.get('sessions')
+# Only the Image Upload page answers requests from a still image
+if sessions is not None:
+    sessions.hold(None)
+
+WEIGHTS = 'tap-n-go-detection.pt'
+
+# Shared, pre-warmed model for every session and rerun in this process
+# (MODEL_BACKEND picks an exported ONNX/OpenVINO model, see AI codes/backends.py)
+@st.cache_resource(show_spinner=False)
+def get_inference_server():
+    return InferenceServer(model_path_from_env(WEIGHTS, os.environ))
+
+inference_server = get_inference_server()
+model = inference_server.model
+
+# Per-process stage timings for VideoProcessor.recv
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    return Metrics.from_env(os.environ, prefix="streamlit")
+
+metrics = get_metrics()
+
+# Uploaded images are inferred once at the slider's lowest confidence; moving
+# the slider only re-filters the cached boxes
+IMAGE_FLOOR_CONF = 0.1
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 32))
+
+@st.cache_resource(show_spinner=False, max_entries=IMAGE_CACHE_SIZE)
+def detect_image(image_hash, _image_np, _session_id):
+    # Keyed by the upload's content hash; the array itself isn't hashed.
+    # The server may cancel the request when fast reruns of this session
+    # queue newer ones; retry a few times, then raise so nothing is cached.
+    for _ in range(3):
+        try:
+            return inference_server.submit(_session_id, _image_np, IMAGE_FLOOR_CONF).result()[0]
+        except CancelledError:
+            continue
+    raise CancelledError()
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # Page configuration
 st.set_page_config(
@@ -131,40 +190,153 @@ with st.expander("📌 Model Information & Guidelines", expanded=False):
               - Similar-looking objects
         """)
 
-# Throttling configuration
-PUBLISH_INTERVAL = 3  # Seconds
+def frame_rate(timestamps):
+    # Frames per second over a deque of recent timestamps
+    if len(timestamps) < 2 or timestamps[-1] == timestamps[0]:
+        return 0.0
+    return (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
 
 class VideoProcessor:
+    # recv() never waits for the model: it hands the newest frame to a
+    # background worker and returns immediately, drawing the most recent
+    # detections on the live frame. Frames arriving while the worker is
+    # busy replace the pending one, so latency can't build up.
+
     def __init__(self):
-        self.last_publish = 0
+        self.session_id = uuid.uuid4().hex
+        # Publishes when the stable class set changes, plus a heartbeat
+        self.publisher = DetectionPublisher.from_env(mqttc, os.getenv("MQTT_TOPIC"), os.environ)
+        self.confidence = confidence_threshold
+        self.input_width = 0  # Downscale frames to this width before inference, 0 = off
+        
+        self._cond = threading.Condition()
+        self._pending = None  # Newest (frame, capture time) not yet taken by the worker
+        self._seq = 0
+        self._result = None  # Latest detections, in full-frame coordinates
+        self._display_times = deque(maxlen=30)
+        self._inference_times = deque(maxlen=30)
+        self._stopped = False
+        self._worker = None  # Started by the first recv()
+
+    @property
+    def display_fps(self):
+        return frame_rate(self._display_times)
+
+    @property
+    def inference_fps(self):
+        return frame_rate(self._inference_times)
         
     def recv(self, frame):
-        img = frame.to_ndarray(format="bgr24")
-        results = model.predict(img, conf=confidence_threshold)
+        stages = {}  # Stage durations of this frame, in seconds
+        start = time.perf_counter()
+        with metrics.span("decode", stages):
+            img = frame.to_ndarray(format="bgr24")
+        
+        with self._cond:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="webrtc-inference", daemon=True)
+                self._worker.start()
+            if self._pending is not None:
+                metrics.increment("frames_skipped_total")
+            self._pending = (img, time.time())
+            result = self._result
+            self._cond.notify()
         
-        # MQTT Publishing with throttling
-        current_time = time.time()
-        if current_time - self.last_publish >= PUBLISH_INTERVAL:
-            detected_classes = set()
-            for result in results:
+        if result is None:
+            out = frame
+        else:
+            # Overlay the latest detections on the current frame
+            with metrics.span("plot", stages):
+                annotated_frame = result.plot(img=img.copy())
+            with metrics.span("encode", stages):
+                out = av.VideoFrame.from_ndarray(annotated_frame, format="bgr24")
+        
+        self._display_times.append(time.perf_counter())
+        stages["total"] = time.perf_counter() - start
+        metrics.observe("total", stages["total"])
+        metrics.increment("frames_total")
+        metrics.trace(stages, session=self.session_id)
+        return out
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                (img, captured_at), self._pending = self._pending, None
+                self._seq += 1
+            
+            stages = {}
+            height, width = img.shape[:2]
+            scale = 1.0
+            if self.input_width and width > self.input_width:
+                scale = width / self.input_width
+                img = cv2.resize(img, (self.input_width, round(height / scale)), interpolation=cv2.INTER_AREA)
+            
+            # Queue wait plus model time; the model's own split is recorded below
+            with metrics.span("predict", stages):
+                future = inference_server.submit(self.session_id, img, self.confidence)
+                try:
+                    results = future.result()
+                except CancelledError:
+                    results = None
+            if results is None:
+                # Dropped by the shared server under load
+                metrics.increment("frames_dropped_total")
+                continue
+            for stage, ms in results[0].speed.items():
+                stages[stage] = ms / 1000
+                metrics.observe(stage, ms / 1000)
+            
+            result = results[0]
+            if scale != 1.0:
+                # Map boxes back onto the full-size frame
+                boxes = result.boxes.data.clone()
+                boxes[:, :4] *= scale
+                result.orig_shape = (height, width)
+                result.update(boxes=boxes)
+            
+            # Change-driven MQTT Publishing
+            with metrics.span("classes", stages):
+                detections = FrameDetections(self._seq, captured_at, time.time())
                 for box in result.boxes:
                     cls_id = int(box.cls.item())
-                    detected_classes.add(model.names[cls_id])
+                    detections.add(model.names[cls_id], float(box.conf.item()))
             
-            self.publish_detection(detected_classes)
-            self.last_publish = current_time
-        
-        # Convert results to video frame
-        annotated_frame = results[0].plot()
-        return av.VideoFrame.from_ndarray(annotated_frame, format="bgr24")
+            with metrics.span("publish", stages):
+                try:
+                    self.publisher.update(detections.classes, detections=detections)
+                    if sessions is not None:
+                        sessions.update(detections)
+                except Exception as e:
+                    print(f"MQTT Error: {str(e)}")
+            
+            with self._cond:
+                self._result = result
+            self._inference_times.append(time.perf_counter())
+            metrics.increment("inferences_total")
+            metrics.trace(stages, session=self.session_id, worker=True)
 
-    def publish_detection(self, detected_classes):
-        msg = ",".join(detected_classes) if detected_classes else "NONE"
-        try:
-            st.session_state.mqttc.publish(os.getenv("MQTT_TOPIC"), msg)
-            st.sidebar.success(f"Published: {msg}")
-        except Exception as e:
-            st.sidebar.error(f"MQTT Error: {str(e)}")
+    def on_ended(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        inference_server.close_session(self.session_id)
+
+def publish_detection(detections):
+    # Same message format as the other publishers (MQTT_PAYLOAD)
+    msg = encode_as(os.getenv("MQTT_PAYLOAD", "text"), detections.classes, detections)
+    try:
+        st.session_state.mqttc.publish(os.getenv("MQTT_TOPIC"), msg)
+        st.sidebar.success(f"Published: {msg}")
+    except Exception as e:
+        st.sidebar.error(f"MQTT Error: {str(e)}")
+
+# Seconds until the script reruns to refresh a polling page, after the
+# whole page (footer included) has been drawn
+poll_interval = 0
 
 # ===== Main Content Area =====
 if input_type == "Image Upload":
@@ -185,22 +357,31 @@ if input_type == "Image Upload":
         with col2:
             st.markdown("**Detection Results**")
             image_np = np.array(image)
-            results = model.predict(image_np, conf=confidence_threshold)
+            image_hash = hashlib.sha256(img_file.getvalue()).hexdigest()
+            try:
+                cached = detect_image(image_hash, image_np, st.session_state.session_id)
+            except CancelledError:
+                st.warning("⚠️ Detector is busy, please try again")
+                st.stop()
+            results = [cached[cached.boxes.conf >= confidence_threshold]]
             st.image(results[0].plot(), use_column_width=True)
 
         # Publish detected classes for image
-        detected_classes = set()
+        detections = FrameDetections(0, time.time(), time.time())
         for result in results:
             for box in result.boxes:
                 cls_id = int(box.cls.item())
-                detected_classes.add(model.names[cls_id])
+                detections.add(model.names[cls_id], float(box.conf.item()))
+        detected_classes = detections.classes
+        if sessions is not None:
+            sessions.hold(detections)
         
         if detected_classes:
             st.success(f"✅ Detected: {', '.join(detected_classes)}")
         else:
             st.warning("⚠️ No objects detected")
         
-        VideoProcessor().publish_detection(detected_classes)
+        publish_detection(detections)
 
 elif input_type == "Video Upload":
     st.subheader("🎥 Video Detection")
@@ -210,41 +391,79 @@ elif input_type == "Video Upload":
         help="Upload a video containing food containers"
     )
     
+    # Offline processing options
+    col1, col2 = st.columns(2)
+    with col1:
+        batch_size = st.slider("Batch Size", min_value=1, max_value=16, value=8)
+    with col2:
+        target_fps = st.slider(
+            "Target FPS (0 = every frame)",
+            min_value=0,
+            max_value=30,
+            value=0,
+            help="Skip frames so that roughly this many frames per second of video are analysed"
+        )
+    
+    # Videos are processed by a background worker process; the script only
+    # polls it, so the session stays responsive and nothing lands on disk
+    # except the job's own output directory
+    job = st.session_state.get('video_job')
+    if job is not None and (video_file is None or job.key != video_file.file_id):
+        # The upload was removed or replaced, its results no longer apply
+        job.cleanup()
+        del st.session_state['video_job']
+        job = None
+    
     if video_file is not None:
-        tfile = tempfile.NamedTemporaryFile(delete=False)
-        tfile.write(video_file.read())
-        
-        cap = cv2.VideoCapture(tfile.name)
-        stframe = st.empty()
-        last_publish = 0  # Track last publish time
-
-        # Add a stop button
-        stop_button = st.button("Stop Processing")
-        
-        while cap.isOpened() and not stop_button:
-            ret, frame = cap.read()
-            if not ret:
+        if st.button("Process Video", disabled=job is not None and job.running):
+            if job is not None:
+                job.cleanup()
+            job = st.session_state.video_job = VideoJob(
+                video_file, inference_server.weights, confidence_threshold, target_fps, batch_size,
+                key=video_file.file_id
+            )
+            st.session_state.video_publisher = DetectionPublisher.from_env(
+                mqttc, os.getenv("MQTT_TOPIC"), os.environ
+            )
+    
+    if job is not None:
+        # Change-driven MQTT publishing, one vote per analysed frame
+        publisher = st.session_state.video_publisher
+        for frame_classes in job.poll():
+            detections = FrameDetections(0, time.time(), time.time())
+            for name, conf in frame_classes.items():
+                detections.add(name, conf)
+            try:
+                msg = publisher.update(detections.classes, detections=detections)
+                if sessions is not None:
+                    sessions.update(detections)
+            except Exception as e:
+                st.sidebar.error(f"MQTT Error: {str(e)}")
                 break
-            
-            results = model.predict(frame, conf=confidence_threshold)
-            annotated_frame = results[0].plot()
-            stframe.image(annotated_frame, channels="BGR", use_column_width=True)
-
-            # Throttled MQTT publishing
-            current_time = time.time()
-            if current_time - last_publish >= PUBLISH_INTERVAL:
-                detected_classes = set()
-                for result in results:
-                    for box in result.boxes:
-                        cls_id = int(box.cls.item())
-                        detected_classes.add(model.names[cls_id])
-                
-                VideoProcessor().publish_detection(detected_classes)
-                last_publish = current_time
+            if msg is not None:
+                st.sidebar.success(f"Published: {msg}")
         
-        cap.release()
-        if stop_button:
-            st.warning("Video processing stopped by user")
+        if job.running:
+            fraction = min(job.position / job.total_frames, 1.0) if job.total_frames else 0.0
+            st.progress(fraction, text=f"{job.processed} frames analysed, {job.fps:.1f} FPS")
+            if st.button("Stop Processing"):
+                job.cancel()
+            poll_interval = 1
+        elif job.status == "error":
+            st.error(f"Video processing failed: {job.error}")
+        else:
+            if job.status == "cancelled":
+                st.warning("Video processing stopped by user")
+            st.success(f"✅ {job.processed} frames analysed")
+            if job.processed:
+                st.video(job.video_path)
+                col1, col2 = st.columns(2)
+                with col1:
+                    with open(job.video_path, "rb") as f:
+                        st.download_button("Download annotated video", f.read(), "annotated.mp4", "video/mp4")
+                with col2:
+                    with open(job.detections_path, "rb") as f:
+                        st.download_button("Download detections (CSV)", f.read(), "detections.csv", "text/csv")
 
 elif input_type == "Webcam":
     st.subheader("📸 Live Webcam Detection")
@@ -253,16 +472,40 @@ elif input_type == "Webcam":
         Detections will be processed in real-time.
     """)
     
-    webrtc_streamer(
+    input_width = st.select_slider(
+        "Inference input width",
+        options=[0, 320, 480, 640],
+        value=0,
+        format_func=lambda width: "Full size" if width == 0 else f"{width} px",
+        help="Downscale webcam frames before inference; detections are still drawn on the full frame"
+    )
+    
+    ctx = webrtc_streamer(
         key="object-detection",
         video_processor_factory=VideoProcessor,
         rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
         media_stream_constraints={"video": True, "audio": False},
         async_processing=True
     )
+    
+    # Display and inference rates are independent: frames are shown at the
+    # camera rate while the model works on the newest one it can take
+    if ctx.video_processor:
+        ctx.video_processor.confidence = confidence_threshold
+        ctx.video_processor.input_width = input_width
+        if ctx.state.playing:
+            processor = ctx.video_processor
+            st.caption(
+                f"Display: {processor.display_fps:.1f} FPS • Inference: {processor.inference_fps:.1f} FPS"
+            )
+            poll_interval = 1
 
 # Footer
 st.markdown("---")
 st.markdown("""
 **Tap N Go Object Detection System • Powered by YOLOv8**
 """)
+
+if poll_interval:
+    time.sleep(poll_interval)
+    st.rerun()
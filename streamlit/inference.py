@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+from ultralytics import YOLO
+
+
+class InferenceServer:
+    # One YOLO model per process, shared by every Streamlit session.
+    # Requests are queued per session and served round-robin by worker
+    # threads, so a busy webcam stream cannot starve other viewers.
+
+    def __init__(self, weights, workers=1, max_pending=2, max_batch=4, imgsz=640):
+        self.weights = weights  # PyTorch weights or an exported model (see AI codes/backends.py)
+        self.model = YOLO(weights, task="detect")
+        self.names = self.model.names
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+
+        # The ultralytics predictor is not safe to call from several threads
+        self._model_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # session id -> deque of (image, conf, future)
+
+        # Warm up so the first real request doesn't pay for lazy initialisation
+        self.predict([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)], conf=0.5)
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"inference-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def predict(self, images, conf):
+        # Synchronous batched predict, bypassing the queue
+        with self._model_lock:
+            return self.model.predict(images, conf=conf, verbose=False)
+
+    def submit(self, session_id, image, conf):
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(session_id, deque())
+            # Backpressure: a session may only have a few frames in flight,
+            # the oldest pending frame is dropped in favour of the new one
+            while len(queue) >= self.max_pending:
+                _, _, stale = queue.popleft()
+                stale.cancel()
+            queue.append((image, conf, future))
+            self._cond.notify()
+        return future
+
+    def close_session(self, session_id):
+        with self._cond:
+            for _, _, future in self._queues.pop(session_id, ()):
+                future.cancel()
+
+    def _next_batch(self):
+        # Take at most one request per session, visiting sessions round-robin.
+        # Only requests sharing the first request's confidence are batched.
+        batch = []
+        conf = None
+        for session_id in list(self._queues):
+            queue = self._queues[session_id]
+            if not queue:
+                continue
+            if conf is None:
+                conf = queue[0][1]
+            elif queue[0][1] != conf:
+                continue
+            batch.append(queue.popleft())
+            self._queues.move_to_end(session_id)
+            if len(batch) >= self.max_batch:
+                break
+        return batch, conf
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: any(self._queues.values()))
+                batch, conf = self._next_batch()
+
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self.predict([image for image, _, _ in batch], conf)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, future), result in zip(batch, results):
+                future.set_result([result])
@@ -0,0 +1,235 @@
+import csv
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+import av
+
+
+class FrameReader:
+    # Decodes a video on a background thread into a bounded queue so the
+    # inference loop never waits on the decoder (and vice versa). The source
+    # may be a path or a file-like object such as an in-memory upload.
+
+    def __init__(self, source, stride=1, target_fps=0, queue_size=32):
+        self.container = av.open(source)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"  # Frame-threaded decode inside FFmpeg
+        self.source_fps = float(self.stream.average_rate or 30)
+        self.total_frames = self.stream.frames
+
+        # A target FPS overrides the stride, e.g. 30 fps source at 10 fps -> every 3rd frame
+        if target_fps:
+            stride = max(1, round(self.source_fps / target_fps))
+        self.stride = stride
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="video-decoder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _put(self, item):
+        # Block while the queue is full, but give up promptly once stopped
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for index, frame in enumerate(self.container.decode(self.stream)):
+                if self._stop.is_set():
+                    break
+                # Frames we stride over are decoded but never converted to BGR
+                if index % self.stride == 0:
+                    if not self._put((index, frame.to_ndarray(format="bgr24"))):
+                        break
+        except av.FFmpegError as e:
+            print(f"Video decode error: {e}")
+        finally:
+            self.container.close()
+            self._put(None)
+
+    def batches(self, batch_size):
+        # Yield (frame indices, frames) lists of up to batch_size frames
+        indices, frames = [], []
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            indices.append(item[0])
+            frames.append(item[1])
+            if len(frames) == batch_size:
+                yield indices, frames
+                indices, frames = [], []
+        if frames:
+            yield indices, frames
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+
+def export_video(source, output_dir, weights, conf, target_fps, batch_size, updates, cancel):
+    # Worker process: annotate the video at source into output_dir/annotated.mp4
+    # and write one CSV row per detection to output_dir/detections.csv (one
+    # row with empty class columns for frames without detections).
+    # Progress and each frame's classes (name -> highest confidence) are
+    # sent back through updates.
+    from ultralytics import YOLO
+
+    try:
+        model = YOLO(weights, task="detect")
+        reader = FrameReader(source, target_fps=target_fps, queue_size=batch_size * 4)
+        total = reader.total_frames
+        output = av.open(os.path.join(output_dir, "annotated.mp4"), "w")
+        stream = output.add_stream("h264", rate=max(1, round(reader.source_fps / reader.stride)))
+        stream.pix_fmt = "yuv420p"
+
+        processed = 0
+        start = time.time()
+        with open(os.path.join(output_dir, "detections.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "time", "class", "conf", "x1", "y1", "x2", "y2"])
+            reader.start()
+            try:
+                for indices, frames in reader.batches(batch_size):
+                    if cancel.is_set():
+                        break
+                    results = model.predict(frames, conf=conf, verbose=False)
+
+                    frame_classes = []
+                    for index, result in zip(indices, results):
+                        detected = {}
+                        if not len(result.boxes):
+                            writer.writerow([index, round(index / reader.source_fps, 3)] + [""] * 6)
+                        for box in result.boxes:
+                            name = model.names[int(box.cls.item())]
+                            box_conf = box.conf.item()
+                            detected[name] = max(detected.get(name, 0.0), box_conf)
+                            x1, y1, x2, y2 = (round(v, 1) for v in box.xyxy[0].tolist())
+                            writer.writerow([index, round(index / reader.source_fps, 3), name,
+                                             round(box_conf, 3), x1, y1, x2, y2])
+                        frame_classes.append(detected)
+
+                        # yuv420p needs even dimensions
+                        annotated = result.plot()
+                        height, width = annotated.shape[:2]
+                        annotated = annotated[:height - height % 2, :width - width % 2]
+                        if not stream.width:
+                            stream.height, stream.width = annotated.shape[:2]
+                        for packet in stream.encode(av.VideoFrame.from_ndarray(annotated, format="bgr24")):
+                            output.mux(packet)
+
+                    processed += len(frames)
+                    updates.put(("progress", indices[-1] + 1, total, processed / max(time.time() - start, 1e-6), frame_classes))
+            finally:
+                reader.stop()
+                if stream.width:
+                    # Flushing a stream that never got a frame fails
+                    for packet in stream.encode():
+                        output.mux(packet)
+                output.close()
+        if cancel.is_set():
+            updates.put(("cancelled", processed))
+        elif not processed:
+            updates.put(("error", "no video frames could be decoded"))
+        else:
+            updates.put(("done", processed))
+    except Exception as e:
+        updates.put(("error", str(e)))
+
+
+def _cleanup(process, cancel, output_dir):
+    cancel.set()
+    process.join(timeout=2)
+    if process.is_alive():
+        process.terminate()
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+class VideoJob:
+    # Runs export_video in a separate process so a long video neither blocks
+    # the Streamlit script nor the shared in-process model. The worker is a
+    # spawned process and can't see the upload's in-memory buffer, so the
+    # upload is streamed into the job's directory for it to decode from
+    # rather than pickled across as one bytes object. The directory is
+    # removed when the job is cleaned up or garbage collected.
+
+    def __init__(self, upload, weights, conf=0.6, target_fps=0, batch_size=8, key=None):
+        self.key = key  # Identifies the upload this job belongs to
+        self.output_dir = tempfile.mkdtemp(prefix="tapngo-video-")
+        self.source_path = os.path.join(self.output_dir, "source")
+        self.video_path = os.path.join(self.output_dir, "annotated.mp4")
+        self.detections_path = os.path.join(self.output_dir, "detections.csv")
+        upload.seek(0)
+        with open(self.source_path, "wb") as f:
+            shutil.copyfileobj(upload, f, 1 << 20)
+
+        self.position = 0  # Source frames covered so far
+        self.total_frames = 0
+        self.processed = 0  # Frames actually analysed
+        self.fps = 0.0
+        self.status = "running"
+        self.error = None
+
+        # spawn: forking a process that already holds torch threads can deadlock
+        context = multiprocessing.get_context("spawn")
+        self._updates = context.Queue()
+        self._cancel = context.Event()
+        self._process = context.Process(
+            target=export_video,
+            args=(self.source_path, self.output_dir, weights, conf, target_fps, batch_size, self._updates, self._cancel),
+            name="video-export",
+            daemon=True
+        )
+        self._process.start()
+        self._finalizer = weakref.finalize(self, _cleanup, self._process, self._cancel, self.output_dir)
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def _drain(self, frame_classes):
+        while True:
+            try:
+                update = self._updates.get_nowait()
+            except queue.Empty:
+                return
+            kind = update[0]
+            if kind == "progress":
+                _, self.position, self.total_frames, self.fps, classes = update
+                self.processed += len(classes)
+                frame_classes.extend(classes)
+            elif kind == "error":
+                self.status, self.error = "error", update[1]
+            else:
+                self.status = kind
+
+    def poll(self):
+        # Apply queued updates; returns the classes of newly analysed frames
+        frame_classes = []
+        self._drain(frame_classes)
+        if self.running and not self._process.is_alive():
+            # The final update may have been sent just before the worker exited
+            self._drain(frame_classes)
+            if self.running:
+                self.status, self.error = "error", f"worker exited with code {self._process.exitcode}"
+        return frame_classes
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cleanup(self):
+        self._finalizer()